@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import instrumentation
+from graph import Graph
+from models import Rating, User, SAN_FRANCISCO_COORDS, limit_data_by_location, read_data
+from random_graph_generator import Generator
+
+
+class Benchmark:
+    # Runs every pipeline stage on a synthetic dataset: the random-graph model of Generator scaled to the
+    # given number of users, plus psql-style dumps of the same users (spread around San Francisco) and ratings.
+    SCALES = {"1k": 1000, "5k": 5000, "50k": 50000, "500k": 500000}
+    DEFAULT_SCALES = ["1k", "5k"]
+    STAGES = (
+        "parse",
+        "region_filter",
+        "edge_build",
+        "persist",
+        "load",
+        "influence_bands",
+        "followings_influence",
+        "csv_export",
+    )
+    INFLUENCE_BANDS = [(0, 0.1), (0.1, 0.2), (0.2, 0.3)]
+    REGION_LONGITUDES = (-122.7, -122.2)
+    REGION_LATITUDES = (37.6, 37.9)
+    REGRESSION_THRESHOLD = 0.2  # relative increase over the baseline that counts as a regression
+    # increases smaller than these are measurement noise, whatever their relative size
+    MIN_REGRESSIONS = {"wall_time": 0.05, "peak_rss_mb": 5}
+    SEED = 0
+
+    def __init__(self, engine=Graph.INDEX_ENGINE, workers=1, seed=SEED):
+        self.engine = engine
+        self.workers = workers
+        self.seed = seed
+
+    def run(self, scale_names, repeat=1):
+        results = {
+            "environment": Benchmark.get_environment(),
+            "settings": {"engine": self.engine, "workers": self.workers, "seed": self.seed, "repeat": repeat},
+            "scales": {},
+        }
+        for scale_name in scale_names:
+            runs = [self.run_scale(Benchmark.SCALES[scale_name]) for _ in range(repeat)]
+            # the best of the repeats, stage by stage, is the least noisy estimate
+            stages = {}
+            for stage in Benchmark.STAGES:
+                metrics = runs[0]["stages"][stage]
+                stages[stage] = {metric: min(run["stages"][stage][metric] for run in runs) for metric in metrics}
+            results["scales"][scale_name] = {"sizes": runs[0]["sizes"], "stages": stages}
+        return results
+
+    def run_scale(self, num_of_users):
+        stages = {}
+        with tempfile.TemporaryDirectory() as directory:
+            self.__write_dataset(directory, num_of_users)
+
+            users, ratings = Benchmark.__measure(stages, "parse", lambda: (
+                read_data(f"{directory}/users.dat", User), read_data(f"{directory}/ratings.dat", Rating)
+            ))
+            Benchmark.__measure(stages, "region_filter", lambda: limit_data_by_location(SAN_FRANCISCO_COORDS, users))
+
+            graph = Graph(data_dir=directory)
+            Benchmark.__measure(stages, "edge_build", lambda: graph.set_nodes_and_edges(self.engine, self.workers))
+            Benchmark.__measure(stages, "persist", graph.checkpoint)
+
+            loaded_graph = Graph(data_dir=directory)
+            Benchmark.__measure(stages, "load", loaded_graph.read_graph)
+            Benchmark.__measure(stages, "influence_bands", lambda: (
+                loaded_graph.get_average_influences_for_top_influential_users(Benchmark.INFLUENCE_BANDS)
+            ))
+            Benchmark.__measure(
+                stages, "followings_influence", loaded_graph.get_average_friends_influence_on_users_rate
+            )
+            Benchmark.__measure(
+                stages, "csv_export", lambda: loaded_graph.export_graph_to_csv(loaded_graph.compact_graph)
+            )
+
+            sizes = {
+                "users": len(users),
+                "ratings": len(ratings),
+                "nodes": loaded_graph.compact_graph.number_of_nodes,
+                "edges": loaded_graph.compact_graph.number_of_edges,
+            }
+        return {"sizes": sizes, "stages": stages}
+
+    def __write_dataset(self, directory, num_of_users):
+        rng = np.random.default_rng([self.seed, num_of_users])
+        num_of_venues = round(num_of_users * Generator.NUM_OF_VENUES / Generator.NUM_OF_USERS)
+        num_of_ratings = round(num_of_users * Generator.NUM_OF_EDGES / Generator.NUM_OF_USERS)
+        # keeps the expected number of followings per user of the Generator samples
+        probability = Generator.FRIENDSHIP_PROBABILITY * (Generator.NUM_OF_USERS - 1) / (num_of_users - 1)
+
+        rating_users, venues, rates = Generator.get_random_ratings(rng, num_of_users, num_of_venues, num_of_ratings)
+        first, second = Generator.get_random_friendships(rng, num_of_users, probability)
+        users = np.column_stack([
+            np.arange(num_of_users),
+            rng.uniform(*Benchmark.REGION_LATITUDES, num_of_users),
+            rng.uniform(*Benchmark.REGION_LONGITUDES, num_of_users),
+        ])
+        ratings = np.column_stack([rating_users, venues, rates])
+
+        np.savetxt(f"{directory}/users.txt", users, fmt=["%d", "%.6f", "%.6f"])
+        np.savetxt(f"{directory}/ratings.txt", ratings, fmt="%d")
+        np.savetxt(f"{directory}/friendships.txt", np.column_stack([first, second]), fmt="%d")
+        open(f"{directory}/checkins.txt", 'w').close()
+
+        dump_header = "{}\n" + "-" * 20
+        np.savetxt(
+            f"{directory}/users.dat", users, fmt=["%d", "%.6f", "%.6f"], delimiter=" | ", comments="",
+            header=dump_header.format("id | latitude | longitude")
+        )
+        np.savetxt(
+            f"{directory}/ratings.dat", ratings, fmt="%d", delimiter=" | ", comments="",
+            header=dump_header.format("user_id | venue_id | rating")
+        )
+
+    @staticmethod
+    def __measure(stages, stage, function):
+        instrumentation.reset_peak_rss()
+        cpu_start = sum(os.times()[:4])
+        start = time.perf_counter()
+        result = function()
+        stages[stage] = {
+            "wall_time": time.perf_counter() - start,
+            "cpu_time": sum(os.times()[:4]) - cpu_start,
+            "peak_rss_mb": instrumentation.get_peak_rss() / 1024,
+        }
+        return result
+
+    @staticmethod
+    def get_environment():
+        return {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+        }
+
+    @staticmethod
+    def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+        # (scale, stage, metric, baseline value, value) for every measurement that got worse than the threshold
+        regressions = []
+        for scale_name, scale_results in results["scales"].items():
+            baseline_stages = baseline["scales"].get(scale_name, {}).get("stages", {})
+            for stage, measurement in scale_results["stages"].items():
+                if stage not in baseline_stages:
+                    continue
+                for metric, min_regression in Benchmark.MIN_REGRESSIONS.items():
+                    baseline_value, value = baseline_stages[stage][metric], measurement[metric]
+                    if value - baseline_value > min_regression and value > baseline_value * (1 + threshold):
+                        regressions.append((scale_name, stage, metric, baseline_value, value))
+        return regressions
+
+    @staticmethod
+    def print_results(results):
+        for scale_name, scale_results in results["scales"].items():
+            print(f"{scale_name}: {scale_results['sizes']}")
+            for stage, measurement in scale_results["stages"].items():
+                print(
+                    f"  {stage:<22}{measurement['wall_time']:>10.3f}s wall{measurement['cpu_time']:>10.3f}s cpu"
+                    f"{measurement['peak_rss_mb']:>10.1f}MB peak"
+                )
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Time and memory-profile the pipeline stages on synthetic data.")
+    parser.add_argument("--scales", nargs="+", choices=list(Benchmark.SCALES), default=Benchmark.DEFAULT_SCALES)
+    parser.add_argument("--engine", choices=[Graph.INDEX_ENGINE, Graph.SPARSE_ENGINE], default=Graph.INDEX_ENGINE)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=Benchmark.SEED)
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--baseline", help="json results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=Benchmark.REGRESSION_THRESHOLD)
+    parser.add_argument("--trace", help="also record the instrumentation spans into this chrome trace file")
+    arguments = parser.parse_args(arguments)
+
+    if arguments.trace:
+        instrumentation.enable(arguments.trace, instrumentation.CHROME_FORMAT)
+
+    results = Benchmark(arguments.engine, arguments.workers, arguments.seed).run(arguments.scales, arguments.repeat)
+    Benchmark.print_results(results)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if arguments.baseline:
+        with open(arguments.baseline, 'r') as file:
+            regressions = Benchmark.compare(results, json.load(file), arguments.threshold)
+        for scale_name, stage, metric, baseline_value, value in regressions:
+            print(f"Regression in {stage} at {scale_name}: {metric} went from {baseline_value:.3f} to {value:.3f}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
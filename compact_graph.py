@@ -0,0 +1,212 @@
+import networkx as nx
+import numpy as np
+from scipy import sparse
+
+
+class CompactGraph:
+    # The similarity graph as integer-indexed arrays: nodes and venues are remapped to 0..n-1,
+    # adjacency, ratings and followings are CSR (indptr + indices) tables over the node index.
+    ROWS_PER_AGREEMENT_BLOCK = 65536
+    VENUE_METADATA_FIELD = "venue_ratings"
+    FOLLOWING_METADATA_FIELD = "followings"
+    LONGITUDE_FIELD = "longitude"
+    LATITUDE_FIELD = "latitude"
+    ARRAY_NAMES = (
+        "node_ids",
+        "longitudes",
+        "latitudes",
+        "adjacency_indptr",
+        "adjacency_indices",
+        "adjacency_weights",
+        "venue_ids",
+        "rating_indptr",
+        "rating_venue_indices",
+        "rating_rates",
+        "following_indptr",
+        "following_indices",
+        "has_followings",
+    )
+
+    def __init__(self, **arrays):
+        for name in self.ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.__node_index = None
+        self.__venue_index = None
+
+    @property
+    def number_of_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def number_of_edges(self):
+        return len(self.adjacency_indices) // 2
+
+    @property
+    def number_of_venues(self):
+        return len(self.venue_ids)
+
+    @property
+    def node_index(self):
+        if self.__node_index is None:
+            self.__node_index = {node_id: index for index, node_id in enumerate(self.node_ids.tolist())}
+        return self.__node_index
+
+    @property
+    def venue_index(self):
+        if self.__venue_index is None:
+            self.__venue_index = {venue_id: index for index, venue_id in enumerate(self.venue_ids.tolist())}
+        return self.__venue_index
+
+    def get_degrees(self):
+        return np.diff(self.adjacency_indptr)
+
+    def get_neighbors(self, index):
+        return self.adjacency_indices[self.adjacency_indptr[index]:self.adjacency_indptr[index + 1]]
+
+    def get_followings(self, index):
+        return self.following_indices[self.following_indptr[index]:self.following_indptr[index + 1]]
+
+    def get_venue_ratings(self, index):
+        start, end = self.rating_indptr[index], self.rating_indptr[index + 1]
+        return self.rating_venue_indices[start:end], self.rating_rates[start:end]
+
+    def get_rating_users(self):
+        return np.repeat(np.arange(self.number_of_nodes), np.diff(self.rating_indptr))
+
+    def get_edges(self):
+        # every undirected edge once, from its lower-indexed endpoint, in graph.edges order
+        sources = np.repeat(np.arange(self.number_of_nodes), self.get_degrees())
+        upper = self.adjacency_indices > sources
+        return sources[upper], self.adjacency_indices[upper], self.adjacency_weights[upper]
+
+    def get_rating_matrix(self, rate=None):
+        # users x venues, 1 where the user rated the venue (with the given rate, if one is given)
+        users = self.get_rating_users()
+        venues = np.asarray(self.rating_venue_indices)
+        if rate is not None:
+            users, venues = users[self.rating_rates == rate], venues[self.rating_rates == rate]
+        return sparse.csr_matrix(
+            (np.ones(len(users), dtype=np.int64), (users, venues)),
+            shape=(self.number_of_nodes, self.number_of_venues)
+        )
+
+    def get_rating_agreements(self, others_indptr, others_indices):
+        # For every user i, with i's others in row i of the given CSR table (neighbors, followings, ...),
+        # count the (venue, other user) pairs both rated and how many of them got the same rate.
+        # (others @ ratings)[i, v] counts i's others that rated v, so masking it with i's own ratings counts
+        # the common pairs, and doing it once per rate counts the equal ones. Rows go in blocks to bound memory.
+        others = sparse.csr_matrix(
+            (np.ones(len(others_indices), dtype=np.int64), np.array(others_indices), np.array(others_indptr)),
+            shape=(self.number_of_nodes, self.number_of_nodes)
+        )
+        rated = self.get_rating_matrix()
+        rate_matrices = [self.get_rating_matrix(rate) for rate in np.unique(self.rating_rates)]
+
+        common = np.zeros(self.number_of_nodes, dtype=np.int64)
+        equal = np.zeros(self.number_of_nodes, dtype=np.int64)
+        for start in range(0, self.number_of_nodes, self.ROWS_PER_AGREEMENT_BLOCK):
+            end = min(start + self.ROWS_PER_AGREEMENT_BLOCK, self.number_of_nodes)
+            block_others = others[start:end]
+            common[start:end] = self.__count_shared_ratings(rated, block_others, start, end)
+            for rate_matrix in rate_matrices:
+                equal[start:end] += self.__count_shared_ratings(rate_matrix, block_others, start, end)
+        return common, equal
+
+    @staticmethod
+    def __count_shared_ratings(rating_matrix, block_others, start, end):
+        return np.asarray(rating_matrix[start:end].multiply(block_others @ rating_matrix).sum(axis=1)).ravel()
+
+    @staticmethod
+    def from_networkx(graph):
+        node_index = {node: index for index, node in enumerate(graph.nodes)}
+        venue_index = {}
+
+        adjacency_indptr = [0]
+        adjacency_indices = []
+        adjacency_weights = []
+        rating_indptr = [0]
+        rating_venue_indices = []
+        rating_rates = []
+        following_indptr = [0]
+        following_indices = []
+        has_followings = []
+        for node in graph.nodes:
+            for neighbor, edge_data in graph.adj[node].items():
+                adjacency_indices.append(node_index[neighbor])
+                adjacency_weights.append(edge_data["weight"])
+            adjacency_indptr.append(len(adjacency_indices))
+
+            for venue_id, rate in graph.nodes[node][CompactGraph.VENUE_METADATA_FIELD].items():
+                rating_venue_indices.append(venue_index.setdefault(int(venue_id), len(venue_index)))
+                rating_rates.append(int(rate))
+            rating_indptr.append(len(rating_venue_indices))
+
+            followings = graph.nodes[node][CompactGraph.FOLLOWING_METADATA_FIELD]
+            has_followings.append(followings is not None)
+            for following in followings or ():
+                following_indices.append(node_index[following])
+            following_indptr.append(len(following_indices))
+
+        return CompactGraph(
+            node_ids=np.array([int(node) for node in graph.nodes], dtype=np.int64),
+            longitudes=np.array(
+                [float(graph.nodes[node][CompactGraph.LONGITUDE_FIELD]) for node in graph.nodes], dtype=np.float64
+            ),
+            latitudes=np.array(
+                [float(graph.nodes[node][CompactGraph.LATITUDE_FIELD]) for node in graph.nodes], dtype=np.float64
+            ),
+            adjacency_indptr=np.array(adjacency_indptr, dtype=np.int64),
+            adjacency_indices=np.array(adjacency_indices, dtype=np.int32),
+            adjacency_weights=np.array(adjacency_weights, dtype=np.float32),
+            venue_ids=np.array(list(venue_index), dtype=np.int64),
+            rating_indptr=np.array(rating_indptr, dtype=np.int64),
+            rating_venue_indices=np.array(rating_venue_indices, dtype=np.int32),
+            rating_rates=np.array(rating_rates, dtype=np.uint8),
+            following_indptr=np.array(following_indptr, dtype=np.int64),
+            following_indices=np.array(following_indices, dtype=np.int32),
+            has_followings=np.array(has_followings, dtype=np.bool_),
+        )
+
+    def to_networkx(self):
+        # ids and rates are handed back as ints, the same types Graph.set_nodes_and_edges stores
+        node_ids = self.node_ids.tolist()
+        venue_ids = self.venue_ids.tolist()
+        rating_venue_ids = [venue_ids[venue] for venue in self.rating_venue_indices.tolist()]
+        rates = self.rating_rates.tolist()
+        rating_indptr = self.rating_indptr.tolist()
+        following_indptr = self.following_indptr.tolist()
+        following_indices = self.following_indices.tolist()
+        has_followings = self.has_followings.tolist()
+        longitudes = self.longitudes.tolist()
+        latitudes = self.latitudes.tolist()
+
+        graph = nx.Graph()
+        for index, node in enumerate(node_ids):
+            start, end = rating_indptr[index], rating_indptr[index + 1]
+            followings = None
+            if has_followings[index]:
+                followings = {
+                    node_ids[following]
+                    for following in following_indices[following_indptr[index]:following_indptr[index + 1]]
+                }
+            graph.add_node(node, **{
+                CompactGraph.VENUE_METADATA_FIELD: dict(zip(rating_venue_ids[start:end], rates[start:end])),
+                CompactGraph.LONGITUDE_FIELD: longitudes[index],
+                CompactGraph.LATITUDE_FIELD: latitudes[index],
+                CompactGraph.FOLLOWING_METADATA_FIELD: followings,
+            })
+
+        sources, targets, weights = self.get_edges()
+        graph.add_weighted_edges_from(zip(
+            [node_ids[source] for source in sources.tolist()],
+            [node_ids[target] for target in targets.tolist()],
+            CompactGraph.get_weight_values(weights)
+        ))
+        return graph
+
+    @staticmethod
+    def get_weight_values(weights):
+        # Weights are stored as float32, so the float64 a build computed is gone. Each one is handed back as the
+        # float64 of its shortest float32 text, which exports the same as the compact graph does.
+        return np.asarray(weights).astype(str).astype(np.float64).tolist()
+
@@ -0,0 +1,115 @@
+import numpy as np
+
+# geojson rounds every coordinate to this many decimals when a Point or Polygon is built
+GEOJSON_PRECISION = 6
+ROUNDING_TIE_TOLERANCE = 1e-6
+
+
+def round_coordinates(values, precision=GEOJSON_PRECISION):
+    # np.round scales, rounds and scales back, which can land on the other side of a tie than the
+    # correctly rounded round() geojson uses, so values close to a tie are rounded one by one
+    values = np.asarray(values, dtype=np.float64)
+    scaled = values * 10 ** precision
+    rounded = np.round(values, precision)
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < ROUNDING_TIE_TOLERANCE
+    rounded[near_tie] = [round(value, precision) for value in values[near_tie].tolist()]
+    return rounded
+
+
+def get_polygons(polygon_coords):
+    # a Polygon is a list of rings (outer ring first, then holes), a MultiPolygon is a list of Polygons
+    if np.ndim(polygon_coords[0][0]) == 1:
+        return [polygon_coords]
+    return polygon_coords
+
+
+def points_in_polygon(longitudes, latitudes, polygon_coords, ignore_boundary=False):
+    # Same answer as turfpy's boolean_point_in_polygon on geojson Points, for whole coordinate arrays:
+    # points on the boundary are inside unless ignore_boundary, points in a hole (or on its boundary) are not
+    longitudes = round_coordinates(longitudes)
+    latitudes = round_coordinates(latitudes)
+    inside = np.zeros(len(longitudes), dtype=np.bool_)
+    for polygon in get_polygons(polygon_coords):
+        rings = [np.column_stack([round_coordinates(coordinates) for coordinates in zip(*ring)]) for ring in polygon]
+        outer_ring = rings[0]
+        candidates = np.flatnonzero(
+            (longitudes >= outer_ring[:, 0].min()) & (longitudes <= outer_ring[:, 0].max())
+            & (latitudes >= outer_ring[:, 1].min()) & (latitudes <= outer_ring[:, 1].max())
+        )
+        in_polygon = points_in_ring(longitudes[candidates], latitudes[candidates], outer_ring, ignore_boundary)
+        for hole in rings[1:]:
+            in_polygon &= ~points_in_ring(longitudes[candidates], latitudes[candidates], hole, not ignore_boundary)
+        inside[candidates[in_polygon]] = True
+    return inside
+
+
+def points_in_ring(x, y, ring, ignore_boundary):
+    # ray casting with turfpy's in_ring arithmetic, edge by edge over all the points at once
+    if ring[0][0] == ring[-1][0] and ring[0][1] == ring[-1][1]:
+        ring = ring[:-1]
+    is_inside = np.zeros(len(x), dtype=np.bool_)
+    on_boundary = np.zeros(len(x), dtype=np.bool_)
+    j = len(ring) - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(len(ring)):
+            xi, yi = ring[i]
+            xj, yj = ring[j]
+            on_boundary |= (
+                    (y * (xi - xj) + yi * (xj - x) + yj * (x - xi) == 0)
+                    & ((xi - x) * (xj - x) <= 0)
+                    & ((yi - y) * (yj - y) <= 0)
+            )
+            is_inside ^= ((yi > y) != (yj > y)) & (x < (xj - xi) * (y - yi) / (yj - yi) + xi)
+            j = i
+    return np.where(on_boundary, not ignore_boundary, is_inside)
+
+
+class RegionGrid:
+    # Buckets points into square cells so each region's exact polygon test only sees the points
+    # in the cells its bounding box overlaps, however many regions there are.
+    CELL_SIZE = 1.0  # degrees
+
+    def __init__(self, regions, cell_size=CELL_SIZE):
+        self.regions = regions
+        self.cell_size = cell_size
+        self.cell_regions = {}
+        for name, polygon_coords in regions.items():
+            coordinates = np.array([
+                point for polygon in get_polygons(polygon_coords) for ring in polygon for point in ring
+            ])
+            min_cell = self.__get_cells(*round_coordinates(coordinates.min(axis=0)))
+            max_cell = self.__get_cells(*round_coordinates(coordinates.max(axis=0)))
+            for cell_x in range(int(min_cell[0]), int(max_cell[0]) + 1):
+                for cell_y in range(int(min_cell[1]), int(max_cell[1]) + 1):
+                    self.cell_regions.setdefault((cell_x, cell_y), []).append(name)
+
+    def get_regions_masks(self, longitudes, latitudes):
+        # one boolean mask per region name, in the order the regions were given
+        longitudes = round_coordinates(longitudes)
+        latitudes = round_coordinates(latitudes)
+        region_candidates = {name: [] for name in self.regions}
+        if len(longitudes) > 0:
+            self.__add_candidates(region_candidates, longitudes, latitudes)
+
+        masks = {}
+        for name, polygon_coords in self.regions.items():
+            masks[name] = np.zeros(len(longitudes), dtype=np.bool_)
+            if not region_candidates[name]:
+                continue
+            candidates = np.concatenate(region_candidates[name])
+            masks[name][candidates] = points_in_polygon(longitudes[candidates], latitudes[candidates], polygon_coords)
+        return masks
+
+    def __add_candidates(self, region_candidates, longitudes, latitudes):
+        # points are grouped by cell, and each cell's points become candidates of the regions overlapping it
+        cells = np.column_stack(self.__get_cells(longitudes, latitudes)).astype(np.int64)
+        unique_cells, point_cells = np.unique(cells, axis=0, return_inverse=True)
+        point_cells = point_cells.ravel()
+        order = np.argsort(point_cells, kind='stable')
+        bounds = np.searchsorted(point_cells[order], np.arange(len(unique_cells) + 1))
+        for cell, (start, end) in zip(map(tuple, unique_cells.tolist()), zip(bounds[:-1], bounds[1:])):
+            for name in self.cell_regions.get(cell, ()):
+                region_candidates[name].append(order[start:end])
+
+    def __get_cells(self, longitudes, latitudes):
+        return np.floor(np.asarray(longitudes) / self.cell_size), np.floor(np.asarray(latitudes) / self.cell_size)
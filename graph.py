@@ -1,31 +1,51 @@
-import csv
 import itertools
 import os
 import pickle
-import random
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from tqdm import tqdm
 import networkx as nx
+import numpy as np
 import statistics
-from models import Rating, Friendship, User
+from models import Rating, RecordBatch, Friendship, User
+import similarity
+from compact_graph import CompactGraph
+from graph_store import GraphStore
+from graph_analysis import GraphAnalysis
+from graph_exporter import GraphExporter
+from graph_sampler import GraphSampler
+from metrics_cache import MetricsCache
+from rating_statistics import RatingStatistics
+from instrumentation import instrumented, span
 
 import matplotlib.pyplot as plt
-import collections
 
 
 class Graph:
-    GRAPH_FILE_NAME = "graph.txt"
+    GRAPH_FILE_NAME = "graph.txt"  # legacy pickled graph, converted to a graph store on first read
+    GRAPH_STORE_DIRECTORY = "graph_store"
+    RATING_STATISTICS_DIRECTORY = "rating_statistics"
+    DATA_FILE_MASKS_DIRECTORY = "data_file_masks"
+    # the columns holding user ids in each data file kept in sync with the graph's nodes
+    DATA_FILE_USER_COLUMNS = {"friendships.txt": (0, 1), "users.txt": (0,), "ratings.txt": (0,), "checkins.txt": (1,)}
+    ROWS_PER_CHUNK = 100000
+    UPDATES_FILE_NAME = "updates.txt"  # ratings, users and friendships applied since the store was saved
+    RATING_UPDATE = "rating"
+    USER_UPDATE = "user"
+    FRIENDSHIP_UPDATE = "friendship"
     JUDGEMENT_VALIDITY_LIMIT = 3  # if there are more common venues than this, judgement_validity will be 1
-    VENUE_METADATA_FIELD = "venue_ratings"
-    FOLLOWING_METADATA_FIELD = "followings"
-    LONGITUDE_FIELD = "longitude"
-    LATITUDE_FIELD = "latitude"
+    MAX_RATE = 5
+    VENUE_METADATA_FIELD = CompactGraph.VENUE_METADATA_FIELD
+    FOLLOWING_METADATA_FIELD = CompactGraph.FOLLOWING_METADATA_FIELD
+    LONGITUDE_FIELD = CompactGraph.LONGITUDE_FIELD
+    LATITUDE_FIELD = CompactGraph.LATITUDE_FIELD
+    INDEX_ENGINE = similarity.INDEX_ENGINE
+    SPARSE_ENGINE = similarity.SPARSE_ENGINE
 
     def plotDegDistLogLog(self, loglog=True):
-        degree_sequence = sorted([d for n, d in self.graph.degree()], reverse=True)  # degree sequence
-        degreeCount = collections.Counter(degree_sequence)
-        deg, cnt = zip(*degreeCount.items())
-        frac = [n / self.graph.number_of_nodes() for n in cnt]
+        deg, frac = self.get_degree_histogram()
         fig, ax = plt.subplots()
 
         plt.plot(deg, frac, 'o')
@@ -38,247 +58,537 @@ class Graph:
         plt.xlabel("Degree")
         plt.show()
 
-    def plot_clustring(self):
-        d = nx.clustering(self.graph)
-        l = []
-        for x in d:
-            l.append(d[x])
+    def plot_clustring(self, seed=None):
         plt.ylabel("Number of nodes")
         plt.xlabel("clustring")
-        plt.hist(l)
+        plt.hist(self.get_clustering(seed=seed))
         plt.show()
 
-    def __init__(self, data_dir):
-        self.graph = nx.Graph()
-        self.data_dir = data_dir
+    def get_degree_histogram(self):
+        return self.__get_cached_metric(
+            "degree_histogram", {}, lambda: GraphAnalysis.get_degree_histogram(self.compact_graph)
+        )
 
+    @instrumented()
+    def get_number_of_connected_components(self):
+        return self.__get_cached_metric(
+            "number_of_connected_components", {},
+            lambda: GraphAnalysis.get_number_of_connected_components(self.compact_graph)
+        )
 
+    @instrumented()
+    def get_clustering(
+            self,
+            error_bound=GraphAnalysis.NODE_ERROR_BOUND,
+            confidence=GraphAnalysis.CONFIDENCE,
+            seed=None,
+            exact=None
+    ):
+        # exact on small graphs (or with exact=True), sampled within error_bound otherwise, see GraphAnalysis;
+        # an unseeded estimate is random, so it is never cached
+        return self.__get_cached_metric(
+            "clustering", {"error_bound": error_bound, "confidence": confidence, "seed": seed, "exact": exact},
+            lambda: GraphAnalysis.get_clustering(self.compact_graph, error_bound, confidence, seed, exact),
+            cacheable=seed is not None or GraphAnalysis.use_exact(self.compact_graph, exact)
+        )
+
+    @instrumented()
+    def get_average_clustering(
+            self,
+            error_bound=GraphAnalysis.ERROR_BOUND,
+            confidence=GraphAnalysis.CONFIDENCE,
+            seed=None,
+            exact=None
+    ):
+        return self.__get_cached_metric(
+            "average_clustering", {"error_bound": error_bound, "confidence": confidence, "seed": seed, "exact": exact},
+            lambda: GraphAnalysis.get_average_clustering(self.compact_graph, error_bound, confidence, seed, exact),
+            cacheable=seed is not None or GraphAnalysis.use_exact(self.compact_graph, exact)
+        )
+
+    def __init__(self, data_dir=None, persist_rating_statistics=True, cache_metrics=True):
+        # without a data_dir the graph lives in memory only, see build_graph and RatingStatistics.set_ratings;
+        # its metrics are then only cached when metrics_cache is set. With one, the cache next to the graph
+        # store is only opened (and created) by the first cached metric.
+        self.compact_graph = None
+        self.graph = nx.Graph()
+        self.data_dir = data_dir
+        self.__isolated_ratings = None
+        self.__pending_friendships = None
+        self.__venue_raters = None
+        self.rating_statistics = RatingStatistics(
+            f'{data_dir}/ratings.txt' if data_dir is not None else None,
+            self.MAX_RATE,
+            f'{data_dir}/{self.GRAPH_STORE_DIRECTORY}/{self.RATING_STATISTICS_DIRECTORY}'
+            if persist_rating_statistics and data_dir is not None else None,
+            f'{data_dir}/{self.GRAPH_STORE_DIRECTORY}/{self.DATA_FILE_MASKS_DIRECTORY}/ratings.npy'
+            if data_dir is not None else None
+        )
+        self.metrics_cache = None
+        self.__metrics_cache_directory = None
+        if cache_metrics and data_dir is not None:
+            self.__metrics_cache_directory = f'{data_dir}/{self.GRAPH_STORE_DIRECTORY}'
+
+    @property
+    def graph(self):
+        # a graph opened from the store is only hydrated into networkx once something asks for it
+        if self.__graph is None:
+            self.__graph = self.__compact_graph.to_networkx()
+        return self.__graph
+
+    @graph.setter
+    def graph(self, graph):
+        self.__graph = graph
+        if graph is not None:
+            self.compact_graph = None
+
+    @property
+    def is_hydrated(self):
+        # whether the networkx graph exists, reading graph otherwise builds it from the compact graph
+        return self.__graph is not None
+
+    @property
+    def compact_graph(self):
+        if self.__compact_graph is None:
+            self.__compact_graph = CompactGraph.from_networkx(self.__graph)
+        return self.__compact_graph
+
+    @compact_graph.setter
+    def compact_graph(self, compact_graph):
+        self.__compact_graph = compact_graph
+        self.__fingerprint = None
+        self.__users_influence = None
+        self.__users_agreement_with_crowd = None
+        self.__users_ranking = None
 
     def get_average_influence_for_top_influential_users(
             self,
             top_influencers_percentage_start,
             top_influencers_percentage_end
     ):
-        user_influence_values = [(user_id, bc_val) for user_id, bc_val in self.__get_users_values().items()]
-        user_influence_values.sort(key=lambda k: k[1])
-        end = len(user_influence_values) - int(len(user_influence_values) * top_influencers_percentage_start)
-        start = len(user_influence_values) - int(len(user_influence_values) * top_influencers_percentage_end)
-        top_influential_users = [user_id for user_id, _ in user_influence_values[start:end]]
-        influences = list(map(self.__calculate_user_influence, top_influential_users))
-        return statistics.mean(influences)
-
-    def __calculate_user_influence(self, user_id):
-        total_common_venues_with_neighbors = 0
-        total_influences_on_neighbors = 0
-        for venue_id, user_rate in self.graph.nodes[user_id][self.VENUE_METADATA_FIELD].items():
-            for node in self.graph.neighbors(user_id):
-                if not self.graph.nodes[node][self.VENUE_METADATA_FIELD].get(venue_id):
-                    continue
-                total_common_venues_with_neighbors += 1
-                if int(self.graph.nodes[node][self.VENUE_METADATA_FIELD][venue_id]) == int(user_rate):
-                    total_influences_on_neighbors += 1
-        return total_influences_on_neighbors / total_common_venues_with_neighbors
-
-    def __get_users_values(self):
-        venue_ratings_percentage = self.__venue_ratings_percentage()
-        values = {}
-        for node in self.graph.nodes:
-            rates = []
-            for venue_id, rate in self.graph.nodes[node][self.VENUE_METADATA_FIELD].items():
-                rates.append(venue_ratings_percentage[venue_id][rate])
-            values[node] = (sum(rates) / len(rates))
-        return values
-
-    def __venue_ratings_percentage(self):
-        ratings = Rating.read_ratings(f'{self.data_dir}/ratings.txt')
-        venue_ratings_percentage = {}
-        for rate in ratings:
-            if venue_ratings_percentage.get(rate.venue_id):
-                venue_ratings_percentage[rate.venue_id][rate.rate] += 1
-            else:
-                venue_ratings_percentage[rate.venue_id] = {"1": 0, "2": 0, "3": 0, "4": 0, "5": 0}
-                venue_ratings_percentage[rate.venue_id][rate.rate] += 1
-
-        for venue in venue_ratings_percentage.values():
-            s = sum(venue.values())
-            for key in venue:
-                venue[key] = venue[key] / s
-
-        return venue_ratings_percentage
-
+        return self.get_average_influences_for_top_influential_users(
+            [(top_influencers_percentage_start, top_influencers_percentage_end)]
+        )[0]
+
+    @instrumented()
+    def get_average_influences_for_top_influential_users(self, percentage_bands):
+        # users are ranked by their agreement with the crowd, so the result also depends on the rating statistics
+        return self.__get_cached_metric(
+            "average_influences_for_top_influential_users", {"percentage_bands": percentage_bands},
+            lambda: self.__get_average_influences_for_top_influential_users(percentage_bands),
+            self.rating_statistics.get_fingerprint()
+        )
+
+    def __get_average_influences_for_top_influential_users(self, percentage_bands):
+        # users are ranked and their influences computed once per graph, every band is a slice of those
+        users_influence = self.get_users_influence()
+        users_ranking = self.__get_users_ranking()
+        average_influences = []
+        for top_influencers_percentage_start, top_influencers_percentage_end in percentage_bands:
+            end = len(users_ranking) - int(len(users_ranking) * top_influencers_percentage_start)
+            start = len(users_ranking) - int(len(users_ranking) * top_influencers_percentage_end)
+            average_influences.append(statistics.mean(users_influence[users_ranking[start:end]].tolist()))
+        return average_influences
+
+    @instrumented()
+    def get_users_influence(self):
+        if self.__users_influence is None:
+            total_common_venues_with_neighbors, total_influences_on_neighbors = (
+                self.compact_graph.get_rating_agreements(
+                    self.compact_graph.adjacency_indptr, self.compact_graph.adjacency_indices
+                )
+            )
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.__users_influence = total_influences_on_neighbors / total_common_venues_with_neighbors
+        return self.__users_influence
+
+    def __get_users_ranking(self):
+        users_agreement_with_crowd = self.get_users_agreement_with_crowd()
+        if self.__users_ranking is None:
+            self.__users_ranking = np.argsort(users_agreement_with_crowd, kind='stable')
+        return self.__users_ranking
+
+    @instrumented()
+    def get_users_agreement_with_crowd(self):
+        # the mean share of the venue's raters that gave the same rate, over each user's ratings
+        if self.__users_agreement_with_crowd is None or self.rating_statistics.refresh():
+            venue_ratings_percentage = self.rating_statistics.get_venue_ratings_percentage(
+                np.asarray(self.compact_graph.venue_ids)
+            )
+            rating_values = venue_ratings_percentage[
+                self.compact_graph.rating_venue_indices, self.compact_graph.rating_rates.astype(np.int64) - 1
+            ]
+            # bincount adds each user's values in row order, the same order sum() adds them in
+            values = np.bincount(
+                self.compact_graph.get_rating_users(), weights=rating_values,
+                minlength=self.compact_graph.number_of_nodes
+            )
+            self.__users_agreement_with_crowd = values / np.diff(self.compact_graph.rating_indptr)
+            self.__users_ranking = None
+        return self.__users_agreement_with_crowd
+
+    @instrumented()
     def get_average_friends_influence_on_users_rate(self):
-        friends_influence_on_users = []
-        for node in self.graph.nodes:
-            if self.graph.nodes[node][self.FOLLOWING_METADATA_FIELD] is None:
-                continue
-            friends_influence_on_users.append(self.__get_friends_influence_on_user(node))
-        friends_influence_on_users = [item for item in friends_influence_on_users if item is not None]
-        return statistics.mean(friends_influence_on_users)
-
-    def __get_friends_influence_on_user(self, node):
-        total_records = 0
-        total_influences = 0
-        for venue_id, user_rate_for_venue in self.graph.nodes[node][self.VENUE_METADATA_FIELD].items():
-            for following in self.graph.nodes[node][self.FOLLOWING_METADATA_FIELD]:
-                following_rate_for_venue = self.graph.nodes[following][self.VENUE_METADATA_FIELD].get(venue_id, None)
-                if following_rate_for_venue is not None:
-                    total_records += 1
-                    if following_rate_for_venue == user_rate_for_venue:
-                        total_influences += 1
-        if total_records == 0:
-            return None
-        return total_influences / total_records
-
-    def set_nodes_and_edges(self):
-        user_venue_ratings = self.__get_user_venue_ratings()
-        users = self.__get_users()
-        user_pairs = list(itertools.combinations(user_venue_ratings, 2))
+        return self.__get_cached_metric(
+            "average_friends_influence_on_users_rate", {}, self.__get_average_friends_influence_on_users_rate
+        )
+
+    def __get_average_friends_influence_on_users_rate(self):
+        friends_influence_on_users = self.get_friends_influence_on_users()
+        return statistics.mean(friends_influence_on_users[~np.isnan(friends_influence_on_users)].tolist())
+
+    @instrumented()
+    def get_friends_influence_on_users(self):
+        # share of (venue, following) pairs where the following rated the venue the same as the user,
+        # NaN for users without followings or whose followings rated none of their venues
+        total_records, total_influences = self.compact_graph.get_rating_agreements(
+            self.compact_graph.following_indptr, self.compact_graph.following_indices
+        )
+        friends_influence_on_users = np.full(self.compact_graph.number_of_nodes, np.nan)
+        has_records = np.asarray(self.compact_graph.has_followings) & (total_records > 0)
+        friends_influence_on_users[has_records] = total_influences[has_records] / total_records[has_records]
+        return friends_influence_on_users
+
+    def __get_cached_metric(self, metric, parameters, compute, *inputs, cacheable=True):
+        # keyed by the content of the compact graph plus whatever other inputs the metric depends on
+        if not cacheable:
+            return compute()
+        if self.metrics_cache is None and self.__metrics_cache_directory is not None:
+            self.metrics_cache = MetricsCache(self.__metrics_cache_directory)
+        if self.metrics_cache is None:
+            return compute()
+        if self.__fingerprint is None:
+            self.__fingerprint = MetricsCache.get_fingerprint(
+                *(getattr(self.compact_graph, name) for name in CompactGraph.ARRAY_NAMES)
+            )
+        return self.metrics_cache.get_or_compute(
+            MetricsCache.get_fingerprint(self.__fingerprint, *inputs), metric, parameters, compute
+        )
+
+    @instrumented()
+    def set_nodes_and_edges(
+            self, engine=INDEX_ENGINE, workers=1, min_weight=None, top_k=None, rewrite_data_files=True
+    ):
+        self.build_graph(
+            self.__get_user_venue_ratings(), self.__get_users(), self.__get_friendships(), engine, workers,
+            min_weight, top_k
+        )
+        self.__update_data_files(rewrite_data_files)
+
+    @instrumented()
+    def build_graph(
+            self, user_venue_ratings, users, followings, engine=INDEX_ENGINE, workers=1, min_weight=None, top_k=None
+    ):
+        # Builds the graph from inputs already in memory: user -> {venue: rate}, user -> (longitude, latitude)
+        # and user -> followed users, with ids and rates as ints. Nothing is read from or written to data_dir.
+        # With min_weight and/or top_k only the edges at least that heavy and/or among the top_k heaviest
+        # of one of their users are kept, users left without edges are not part of the graph.
+        self.__isolated_ratings = None
+        self.__pending_friendships = None
+        self.__venue_raters = None
         print("calculating edges ...")
-        for pair in tqdm(user_pairs):
-            temp_rating_diffs = []
-            for vid in user_venue_ratings[pair[0]]:
-                if user_venue_ratings[pair[1]].get(vid):
-                    diff = int(user_venue_ratings[pair[1]].get(vid)) - int(user_venue_ratings[pair[0]].get(vid))
-                    temp_rating_diffs.append((5 - abs(diff)) / 5)
-
-            judgement_validity = self.__get_judgement_validity(len(temp_rating_diffs))
-            if len(temp_rating_diffs) > 0:
-                self.graph.add_edge(pair[0], pair[1], weight=statistics.mean(temp_rating_diffs) * judgement_validity)
-
-                self.graph.nodes[pair[0]][self.VENUE_METADATA_FIELD] = user_venue_ratings[pair[0]]
-                self.graph.nodes[pair[1]][self.VENUE_METADATA_FIELD] = user_venue_ratings[pair[1]]
-
-                longitude, latitude = users[pair[0]]
-                self.graph.nodes[pair[0]][self.LONGITUDE_FIELD] = longitude
-                self.graph.nodes[pair[0]][self.LATITUDE_FIELD] = latitude
-                longitude, latitude = users[pair[1]]
-                self.graph.nodes[pair[1]][self.LONGITUDE_FIELD] = longitude
-                self.graph.nodes[pair[1]][self.LATITUDE_FIELD] = latitude
-        self.__update_data_files()
-
-        friendships = self.__get_friendships()
+        edges = similarity.get_weighted_edges(
+            user_venue_ratings, self.JUDGEMENT_VALIDITY_LIMIT, engine=engine, workers=workers,
+            min_weight=min_weight, top_k=top_k
+        )
+        for user1, user2, weight in edges:
+            self.graph.add_edge(user1, user2, weight=weight)
+        for node in self.graph.nodes:
+            self.graph.nodes[node][self.VENUE_METADATA_FIELD] = user_venue_ratings[node]
+            longitude, latitude = users[node]
+            self.graph.nodes[node][self.LONGITUDE_FIELD] = longitude
+            self.graph.nodes[node][self.LATITUDE_FIELD] = latitude
+
+        # followings outside the graph are dropped, users left without any get None
         for node in tqdm(self.graph.nodes):
-            if friendships.get(node) is None:
-                self.graph.nodes[node][self.FOLLOWING_METADATA_FIELD] = None
-                continue
-            to_be_removed = []
-            for following in friendships.get(node):
-                if self.graph.nodes.get(following) is None:
-                    to_be_removed.append(following)
-            for user in to_be_removed:
-                friendships.get(node).remove(user)
-            self.graph.nodes[node][self.FOLLOWING_METADATA_FIELD] = friendships.get(node)
+            node_followings = {following for following in followings.get(node, ()) if following in self.graph}
+            self.graph.nodes[node][self.FOLLOWING_METADATA_FIELD] = node_followings or None
+        self.compact_graph = None
+
+        if self.rating_statistics.ratings_file is None:
+            # without a ratings file the crowd is the nodes' own ratings, until set_ratings is given others
+            venue_ratings = [user_venue_ratings[node] for node in self.graph.nodes]
+            self.rating_statistics.set_ratings(
+                [venue_id for node_ratings in venue_ratings for venue_id in node_ratings],
+                [rate for node_ratings in venue_ratings for rate in node_ratings.values()]
+            )
 
     def __get_user_venue_ratings(self):
-        ratings = Rating.read_ratings(f'{self.data_dir}/ratings.txt')
+        ratings = RecordBatch.read(f'{self.data_dir}/ratings.txt', Rating)
         user_venue_ratings = {}
-        for rate in ratings:
-            if user_venue_ratings.get(rate.user_id):
-                user_venue_ratings[rate.user_id][rate.venue_id] = rate.rate
+        for user_id, venue_id, rate in zip(
+                ratings["user_id"].tolist(), ratings["venue_id"].tolist(), ratings["rate"].tolist()
+        ):
+            if user_venue_ratings.get(user_id):
+                user_venue_ratings[user_id][venue_id] = rate
             else:
-                user_venue_ratings[rate.user_id] = {rate.venue_id: rate.rate}
+                user_venue_ratings[user_id] = {venue_id: rate}
 
         return user_venue_ratings
 
     def __get_friendships(self):
-        friendships = Friendship.read_friendships(f'{self.data_dir}/friendships.txt')
+        friendships = RecordBatch.read(f'{self.data_dir}/friendships.txt', Friendship)
         followings = {}
-        for friendship in friendships:
-            if followings.get(friendship.first):
-                followings[friendship.first].add(friendship.second)
+        for first, second in zip(friendships["first"].tolist(), friendships["second"].tolist()):
+            if followings.get(first):
+                followings[first].add(second)
             else:
-                followings[friendship.first] = {friendship.second}
+                followings[first] = {second}
         return followings
 
     def __get_users(self):
-        return {user.identifier: (user.long, user.lat) for user in User.read_users(f"{self.data_dir}/users.txt")}
-
-    def __get_judgement_validity(self, amount):
-        if amount >= self.JUDGEMENT_VALIDITY_LIMIT:
-            return 1
-        return amount / self.JUDGEMENT_VALIDITY_LIMIT
-
-    def create_graph_from_inputs(self):
-        self.set_nodes_and_edges()
-        pickle.dump(self.graph, open(f'{self.data_dir}/{self.GRAPH_FILE_NAME}', 'wb'))
-
-    def export_graph_to_csv(self, graph, prefix=""):
-        with open(f"{self.data_dir}/{prefix}nodes.csv", 'w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(["ID", "longitude", "latitude"])
-            for node in graph.nodes:
-                writer.writerow([
-                    node,
-                    graph.nodes[node][self.LONGITUDE_FIELD],
-                    graph.nodes[node][self.LATITUDE_FIELD]
-                ])
-        with open(f"{self.data_dir}/{prefix}edges.csv", 'w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(["Source", "Target", "weight"])
-            for edge in graph.edges:
-                writer.writerow([edge[0], edge[1], graph.get_edge_data(*edge)["weight"]])
-
-    def get_limited_random_graph(self, num_of_nodes, seed=None):
-        assert num_of_nodes < self.graph.number_of_nodes()
-        if seed is not None:
-            random.seed(seed)
-        nodes = set(random.sample(self.graph.nodes, num_of_nodes))
-        new_graph = nx.Graph()
-        for node1, node2, edge_data in self.graph.edges(data=True):
-            if node1 not in nodes or node2 not in nodes:
-                continue
-            new_graph.add_edge(node1, node2, weight=edge_data["weight"])
-            new_graph.nodes[node1][self.VENUE_METADATA_FIELD] = self.graph.nodes[node1][self.VENUE_METADATA_FIELD]
-            new_graph.nodes[node2][self.VENUE_METADATA_FIELD] = self.graph.nodes[node2][self.VENUE_METADATA_FIELD]
-            new_graph.nodes[node1][self.LONGITUDE_FIELD] = self.graph.nodes[node1][self.LONGITUDE_FIELD]
-            new_graph.nodes[node1][self.LATITUDE_FIELD] = self.graph.nodes[node1][self.LATITUDE_FIELD]
-            new_graph.nodes[node2][self.LONGITUDE_FIELD] = self.graph.nodes[node2][self.LONGITUDE_FIELD]
-            new_graph.nodes[node2][self.LATITUDE_FIELD] = self.graph.nodes[node2][self.LATITUDE_FIELD]
-            new_graph.nodes[node1][self.FOLLOWING_METADATA_FIELD] = self.graph.nodes[node1][self.FOLLOWING_METADATA_FIELD]
-            new_graph.nodes[node2][self.FOLLOWING_METADATA_FIELD] = self.graph.nodes[node2][self.FOLLOWING_METADATA_FIELD]
-        return new_graph
+        users = RecordBatch.read(f"{self.data_dir}/users.txt", User)
+        return dict(zip(users["identifier"].tolist(), zip(users["long"].tolist(), users["lat"].tolist())))
 
-    def read_graph(self):
-        self.graph = pickle.load(open(f'{self.data_dir}/{self.GRAPH_FILE_NAME}', 'rb'))
-
-    def __update_data_files(self):
-        nodes = set(self.graph.nodes)
-
-        # Update friendships
-        with open(f"{self.data_dir}/friendships.txt", 'r') as file:
-            friendship_rows = file.readlines()
-        with open(f"{self.data_dir}/friendships.txt", 'w') as file:
-            for row in friendship_rows:
-                user1, user2 = row.split()
-                if user1 in nodes and user2 in nodes:
-                    file.write(row)
-
-        # Update users
-        with open(f"{self.data_dir}/users.txt", 'r') as file:
-            users_rows = file.readlines()
-        with open(f"{self.data_dir}/users.txt", 'w') as file:
-            for row in users_rows:
-                user = row.split()[0]
-                if user in nodes:
-                    file.write(row)
-
-        # Update ratings.txt
-        with open(f"{self.data_dir}/ratings.txt", 'r') as file:
-            ratings_rows = file.readlines()
-        with open(f"{self.data_dir}/ratings.txt", 'w') as file:
-            for row in ratings_rows:
-                user = row.split()[0]
-                if user in nodes:
-                    file.write(row)
-
-        # Update checkins.txt
-        with open(f"{self.data_dir}/checkins.txt", 'r') as file:
-            checkins_rows = file.readlines()
-        with open(f"{self.data_dir}/checkins.txt", 'w') as file:
-            for row in checkins_rows:
-                user = row.split()[1]
-                if user in nodes:
-                    file.write(row)
+    def create_graph_from_inputs(
+            self, engine=INDEX_ENGINE, workers=1, min_weight=None, top_k=None, rewrite_data_files=True
+    ):
+        self.set_nodes_and_edges(engine, workers, min_weight, top_k, rewrite_data_files)
+        self.checkpoint()
+
+    def export_graph_to_csv(self, graph, prefix="", compression=None):
+        return self.export_graph(graph, prefix, GraphExporter.CSV_FORMAT, compression)
 
+    def export_graph(self, graph, prefix="", file_format=GraphExporter.CSV_FORMAT, compression=None):
+        return GraphExporter(file_format, compression).export(graph, self.data_dir, prefix)
 
+    def get_limited_random_graph(
+            self, num_of_nodes, seed=None, strategy=GraphSampler.UNIFORM, copy_metadata=False
+    ):
+        # the subgraph induced by num_of_nodes sampled users, see GraphSampler for the strategies
+        assert num_of_nodes < self.compact_graph.number_of_nodes
+        return GraphSampler(self, seed).sample(num_of_nodes, strategy, copy_metadata)
 
+    @instrumented()
+    def read_graph(self):
+        store_directory = f'{self.data_dir}/{self.GRAPH_STORE_DIRECTORY}'
+        self.__isolated_ratings = None
+        self.__pending_friendships = None
+        self.__venue_raters = None
+        if GraphStore.exists(store_directory):
+            self.compact_graph = GraphStore.open(store_directory)
+            self.graph = None
+            self.__replay_updates()
+            return
+        # the pickle holds string ids, going through the compact graph turns them into ints
+        with open(f'{self.data_dir}/{self.GRAPH_FILE_NAME}', 'rb') as file:
+            self.compact_graph = CompactGraph.from_networkx(pickle.load(file))
+        self.graph = None
+        GraphStore.save(self.compact_graph, store_directory)
+
+    def checkpoint(self):
+        # swaps the current graph in as the store (atomically, see GraphStore) and drops the updates now part of it
+        GraphStore.save(self.compact_graph, f'{self.data_dir}/{self.GRAPH_STORE_DIRECTORY}')
+        if os.path.exists(self.__get_updates_file()):
+            os.remove(self.__get_updates_file())
+
+    def apply_ratings(self, ratings, users=()):
+        # Adds new (or changed) ratings without a rebuild: only pairs that co-rated one of the rated venues
+        # get their edge recomputed. users are the User records of raters that have no coordinates on file yet.
+        ratings = list(ratings)
+        users = list(users)
+        self.__apply_ratings(ratings, users)
+        self.__append_updates(users, f"{self.data_dir}/users.txt", self.USER_UPDATE)
+        self.__append_updates(ratings, f"{self.data_dir}/ratings.txt", self.RATING_UPDATE)
+
+    def apply_friendships(self, friendships):
+        friendships = list(friendships)
+        self.__apply_friendships(friendships)
+        self.__append_updates(friendships, f"{self.data_dir}/friendships.txt", self.FRIENDSHIP_UPDATE)
+
+    def __apply_ratings(self, ratings, users):
+        venue_new_raters = {}
+        for rating in ratings:
+            user_id, venue_id = int(rating.user_id), int(rating.venue_id)
+            self.__get_user_ratings(user_id)[venue_id] = int(rating.rate)
+            venue_new_raters.setdefault(venue_id, set()).add(user_id)
+
+        user_pairs = set()
+        venue_raters = self.__get_venue_raters()
+        for venue_id, new_raters in venue_new_raters.items():
+            raters = venue_raters.setdefault(venue_id, set())
+            raters |= new_raters
+            for user1 in new_raters:
+                for user2 in raters:
+                    if user1 != user2:
+                        user_pairs.add((min(user1, user2), max(user1, user2)))
+
+        weighted_edges = [
+            (user1, user2, similarity.get_pair_weight(
+                self.__get_user_ratings(user1), self.__get_user_ratings(user2), self.JUDGEMENT_VALIDITY_LIMIT
+            ))
+            for user1, user2 in sorted(user_pairs)
+        ]
+        new_nodes = list(dict.fromkeys(
+            user for user1, user2, _ in weighted_edges for user in (user1, user2) if user not in self.graph
+        ))
+        if new_nodes:
+            # read before the new nodes join, so their friendships on file count as pending
+            self.__get_pending_friendships()
+        self.graph.add_weighted_edges_from(weighted_edges)
+
+        if new_nodes:
+            users = {int(user.identifier): (float(user.long), float(user.lat)) for user in users}
+            file_users = None
+            for node in new_nodes:
+                if node not in users and file_users is None:
+                    file_users = self.__get_users()
+                longitude, latitude = users[node] if node in users else file_users[node]
+                self.graph.nodes[node][self.VENUE_METADATA_FIELD] = self.__isolated_ratings.pop(node)
+                self.graph.nodes[node][self.LONGITUDE_FIELD] = longitude
+                self.graph.nodes[node][self.LATITUDE_FIELD] = latitude
+                self.graph.nodes[node][self.FOLLOWING_METADATA_FIELD] = None
+            # friendships made while one of their users was not a node yet, as set_nodes_and_edges would keep
+            for node in new_nodes:
+                for first, second in self.__get_pending_friendships().pop(node, ()):
+                    if first in self.graph and second in self.graph:
+                        self.__add_following(first, second)
+        self.compact_graph = None
+
+    def __apply_friendships(self, friendships):
+        # like set_nodes_and_edges, only followings that are nodes of the graph are kept
+        for friendship in friendships:
+            first, second = int(friendship.first), int(friendship.second)
+            if first in self.graph and second in self.graph:
+                self.__add_following(first, second)
+                continue
+            for user in (first, second):
+                if user not in self.graph:
+                    self.__get_pending_friendships().setdefault(user, set()).add((first, second))
+        self.compact_graph = None
+
+    def __add_following(self, first, second):
+        if self.graph.nodes[first][self.FOLLOWING_METADATA_FIELD] is None:
+            self.graph.nodes[first][self.FOLLOWING_METADATA_FIELD] = {second}
+        else:
+            self.graph.nodes[first][self.FOLLOWING_METADATA_FIELD].add(second)
+
+    def __get_pending_friendships(self):
+        # friendships with a user that is not a node yet, under each such user, kept until both are nodes
+        if self.__pending_friendships is None:
+            self.__pending_friendships = {}
+            friendships = RecordBatch.read(f'{self.data_dir}/friendships.txt', Friendship)
+            for first, second in zip(friendships["first"].tolist(), friendships["second"].tolist()):
+                for user in (first, second):
+                    if user not in self.graph:
+                        self.__pending_friendships.setdefault(user, set()).add((first, second))
+        return self.__pending_friendships
+
+    def __get_user_ratings(self, user_id):
+        if user_id in self.graph:
+            return self.graph.nodes[user_id][self.VENUE_METADATA_FIELD]
+        return self.__get_isolated_ratings().setdefault(user_id, {})
+
+    def __get_isolated_ratings(self):
+        # ratings of users without any edge yet, they become nodes once someone co-rates with them
+        if self.__isolated_ratings is None:
+            self.__isolated_ratings = {}
+            ratings = RecordBatch.read(f'{self.data_dir}/ratings.txt', Rating)
+            for user_id, venue_id, rate in zip(
+                    ratings["user_id"].tolist(), ratings["venue_id"].tolist(), ratings["rate"].tolist()
+            ):
+                if user_id not in self.graph:
+                    self.__isolated_ratings.setdefault(user_id, {})[venue_id] = rate
+        return self.__isolated_ratings
+
+    def __get_venue_raters(self):
+        # venue -> every user that rated it, nodes or not, built once and then kept up to date by __apply_ratings
+        if self.__venue_raters is None:
+            self.__venue_raters = {}
+            rating_users = self.compact_graph.node_ids[self.compact_graph.get_rating_users()]
+            rating_venues = self.compact_graph.venue_ids[self.compact_graph.rating_venue_indices]
+            for user_id, venue_id in zip(rating_users.tolist(), rating_venues.tolist()):
+                self.__venue_raters.setdefault(venue_id, set()).add(user_id)
+            for user_id, venue_ratings in self.__get_isolated_ratings().items():
+                for venue_id in venue_ratings:
+                    self.__venue_raters.setdefault(venue_id, set()).add(user_id)
+        return self.__venue_raters
+
+    def __append_updates(self, records, file_address, update_type):
+        if not records:
+            return
+        with open(file_address, 'a') as file:
+            for record in records:
+                file.write(f"{record.get_string()}\n")
+        os.makedirs(f'{self.data_dir}/{self.GRAPH_STORE_DIRECTORY}', exist_ok=True)
+        with open(self.__get_updates_file(), 'a') as file:
+            for record in records:
+                file.write(f"{update_type} {record.get_string()}\n")
+
+    def __replay_updates(self):
+        # applies the updates logged since the store was saved, in the order they were made
+        if not os.path.exists(self.__get_updates_file()):
+            return
+        ratings = []
+        users = []
+        with open(self.__get_updates_file(), 'r') as file:
+            for line in file:
+                update_type, *inputs = line.split()
+                if update_type == self.USER_UPDATE:
+                    users.append(User.create_from_raw_inputs(inputs))
+                elif update_type == self.RATING_UPDATE:
+                    ratings.append(Rating.create_from_raw_inputs(inputs))
+                else:
+                    if ratings:
+                        self.__apply_ratings(ratings, users)
+                        ratings = []
+                        users = []
+                    self.__apply_friendships([Friendship.create_from_raw_inputs(inputs)])
+        if ratings:
+            self.__apply_ratings(ratings, users)
+
+    def __get_updates_file(self):
+        return f'{self.data_dir}/{self.GRAPH_STORE_DIRECTORY}/{self.UPDATES_FILE_NAME}'
+
+    @instrumented()
+    def __update_data_files(self, rewrite=True):
+        # Keeps the rows of the data files whose users are all nodes of the graph. Each file is streamed into
+        # a temporary file that replaces it once complete, so a crash leaves either the old or the new file.
+        # Without rewrite the files stay as they are and the per-row masks are saved next to the graph store.
+        # rows are matched on the text of their ids
+        nodes = {str(node) for node in self.graph.nodes}
+        with ThreadPoolExecutor(max_workers=len(self.DATA_FILE_USER_COLUMNS)) as executor:
+            futures = {
+                file_name: executor.submit(self.__filter_data_file, file_name, user_columns, nodes, rewrite)
+                for file_name, user_columns in self.DATA_FILE_USER_COLUMNS.items()
+            }
+            masks = {file_name: future.result() for file_name, future in futures.items()}
+
+        masks_directory = f'{self.data_dir}/{self.GRAPH_STORE_DIRECTORY}/{self.DATA_FILE_MASKS_DIRECTORY}'
+        if rewrite:
+            # masks of an earlier unpruned build would no longer line up with the rewritten files
+            shutil.rmtree(masks_directory, ignore_errors=True)
+        else:
+            os.makedirs(masks_directory, exist_ok=True)
+            for file_name, mask in masks.items():
+                np.save(f"{masks_directory}/{os.path.splitext(file_name)[0]}.npy", mask)
+        return masks
+
+    def __filter_data_file(self, file_name, user_columns, nodes, rewrite):
+        file_address = f"{self.data_dir}/{file_name}"
+        mask = []
+        if not os.path.exists(file_address):
+            return np.array(mask, dtype=np.bool_)
+        with span("filter_data_file", file=file_name) as current:
+            output = None
+            if rewrite:
+                output = tempfile.NamedTemporaryFile('w', dir=self.data_dir, prefix=f".{file_name}.", delete=False)
+            try:
+                with open(file_address, 'r') as file:
+                    for rows in iter(lambda: list(itertools.islice(file, self.ROWS_PER_CHUNK)), []):
+                        keep = [all(row.split()[column] in nodes for column in user_columns) for row in rows]
+                        mask.extend(keep)
+                        if output is not None:
+                            output.writelines(row for row, is_kept in zip(rows, keep) if is_kept)
+                if output is not None:
+                    output.close()
+                    shutil.copymode(file_address, output.name)
+                    os.replace(output.name, file_address)
+            except BaseException:
+                if output is not None:
+                    output.close()
+                    os.remove(output.name)
+                raise
+            current.add_count("rows", len(mask))
+            current.add_count("kept", sum(mask))
+        return np.array(mask, dtype=np.bool_)
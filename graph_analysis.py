@@ -0,0 +1,145 @@
+import math
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+
+class GraphAnalysis:
+    # Degree and clustering statistics of a CompactGraph, computed from its CSR adjacency and returned as
+    # arrays so they can be plotted (or not) separately. Clustering is unweighted, like nx.clustering on the
+    # similarity graph. Above EXACT_EDGE_LIMIT edges it is estimated by sampling wedges (pairs of neighbors
+    # of a node) and checking whether they are closed, with the sample size from Hoeffding's bound: the
+    # estimate is within error_bound of the exact value with probability confidence.
+    EXACT_EDGE_LIMIT = 200000
+    ERROR_BOUND = 0.01
+    NODE_ERROR_BOUND = 0.05
+    CONFIDENCE = 0.95
+    ROWS_PER_BLOCK = 4096
+    WEDGES_PER_BLOCK = 1 << 20
+
+    @staticmethod
+    def get_degree_histogram(compact_graph):
+        # the degrees that occur and the fraction of nodes having each of them
+        counts = np.bincount(compact_graph.get_degrees())
+        degrees = np.flatnonzero(counts)
+        return degrees, counts[degrees] / compact_graph.number_of_nodes
+
+    @staticmethod
+    def get_number_of_connected_components(compact_graph):
+        return int(csgraph.connected_components(GraphAnalysis.get_adjacency_matrix(compact_graph), directed=False)[0])
+
+    @staticmethod
+    def get_average_clustering(
+            compact_graph, error_bound=ERROR_BOUND, confidence=CONFIDENCE, seed=None, exact=None
+    ):
+        # mean clustering over all nodes, nodes with fewer than two neighbors count as 0 (as in nx)
+        if GraphAnalysis.use_exact(compact_graph, exact):
+            return float(GraphAnalysis.get_exact_clustering(compact_graph).mean())
+        rng = np.random.default_rng(seed)
+        num_of_samples = GraphAnalysis.get_num_of_samples(error_bound, confidence)
+        edge_keys = GraphAnalysis.get_edge_keys(compact_graph)
+        closed = 0
+        for start in range(0, num_of_samples, GraphAnalysis.WEDGES_PER_BLOCK):
+            block_size = min(GraphAnalysis.WEDGES_PER_BLOCK, num_of_samples - start)
+            nodes = rng.integers(0, compact_graph.number_of_nodes, block_size)
+            closed += int(GraphAnalysis.__sample_closed_wedges(compact_graph, edge_keys, nodes, rng).sum())
+        return closed / num_of_samples
+
+    @staticmethod
+    def get_clustering(compact_graph, error_bound=NODE_ERROR_BOUND, confidence=CONFIDENCE, seed=None, exact=None):
+        # per-node clustering, in node index order; a node with fewer wedges than the samples it would need
+        # is cheaper to count exactly, so only the others are estimated
+        if GraphAnalysis.use_exact(compact_graph, exact):
+            return GraphAnalysis.get_exact_clustering(compact_graph)
+        rng = np.random.default_rng(seed)
+        num_of_samples = GraphAnalysis.get_num_of_samples(error_bound, confidence)
+        degrees = compact_graph.get_degrees()
+        wedges = degrees * (degrees - 1) // 2
+        sampled = wedges > num_of_samples
+
+        clustering = np.zeros(compact_graph.number_of_nodes)
+        exact_nodes = np.flatnonzero(~sampled)
+        clustering[exact_nodes] = GraphAnalysis.get_exact_clustering(compact_graph, exact_nodes)
+        sampled_nodes = np.flatnonzero(sampled)
+        edge_keys = GraphAnalysis.get_edge_keys(compact_graph)
+        nodes_per_block = max(1, GraphAnalysis.WEDGES_PER_BLOCK // num_of_samples)
+        for start in range(0, len(sampled_nodes), nodes_per_block):
+            block_nodes = sampled_nodes[start:start + nodes_per_block]
+            closed = GraphAnalysis.__sample_closed_wedges(
+                compact_graph, edge_keys, np.repeat(block_nodes, num_of_samples), rng
+            )
+            clustering[block_nodes] = closed.reshape(len(block_nodes), num_of_samples).mean(axis=1)
+        return clustering
+
+    @staticmethod
+    def get_exact_clustering(compact_graph, nodes=None):
+        # 2 * triangles / (degree * (degree - 1)) of the given nodes (all by default), 0 below degree 2
+        if nodes is None:
+            nodes = np.arange(compact_graph.number_of_nodes)
+        degrees = compact_graph.get_degrees()[nodes]
+        triangles = GraphAnalysis.get_triangles(compact_graph, nodes)
+        clustering = np.zeros(len(nodes))
+        has_wedges = degrees > 1
+        clustering[has_wedges] = 2 * triangles[has_wedges] / (degrees[has_wedges] * (degrees[has_wedges] - 1))
+        return clustering
+
+    @staticmethod
+    def get_triangles(compact_graph, nodes):
+        # (A @ A)[v, w] counts the common neighbors of v and w, summing it over v's neighbors w counts
+        # every triangle through v twice. Rows go in blocks to bound the memory of the product.
+        adjacency = GraphAnalysis.get_adjacency_matrix(compact_graph)
+        triangles = np.zeros(len(nodes), dtype=np.int64)
+        for start in range(0, len(nodes), GraphAnalysis.ROWS_PER_BLOCK):
+            block = adjacency[nodes[start:start + GraphAnalysis.ROWS_PER_BLOCK]]
+            triangles[start:start + GraphAnalysis.ROWS_PER_BLOCK] = np.asarray(
+                block.multiply(block @ adjacency).sum(axis=1)
+            ).ravel() // 2
+        return triangles
+
+    @staticmethod
+    def get_adjacency_matrix(compact_graph):
+        return sparse.csr_matrix(
+            (
+                np.ones(len(compact_graph.adjacency_indices), dtype=np.int64),
+                np.array(compact_graph.adjacency_indices),
+                np.array(compact_graph.adjacency_indptr),
+            ),
+            shape=(compact_graph.number_of_nodes, compact_graph.number_of_nodes)
+        )
+
+    @staticmethod
+    def get_num_of_samples(error_bound, confidence):
+        # Hoeffding: P(|estimate - mean| >= error_bound) <= 2 exp(-2 samples error_bound^2)
+        return math.ceil(math.log(2 / (1 - confidence)) / (2 * error_bound ** 2))
+
+    @staticmethod
+    def use_exact(compact_graph, exact):
+        if exact is None:
+            return compact_graph.number_of_edges <= GraphAnalysis.EXACT_EDGE_LIMIT
+        return exact
+
+    @staticmethod
+    def __sample_closed_wedges(compact_graph, edge_keys, nodes, rng):
+        # one uniformly drawn wedge per given node, True where its two ends are neighbors;
+        # nodes with fewer than two neighbors have no wedge and count as open
+        indptr = np.asarray(compact_graph.adjacency_indptr)
+        indices = np.asarray(compact_graph.adjacency_indices)
+        degrees = np.diff(indptr)[nodes]
+        closed = np.zeros(len(nodes), dtype=np.bool_)
+        has_wedges = degrees > 1
+        nodes, degrees = nodes[has_wedges], degrees[has_wedges]
+        first = rng.integers(0, degrees)
+        second = rng.integers(0, degrees - 1)
+        second += second >= first
+        keys = indices[indptr[nodes] + first].astype(np.int64) * compact_graph.number_of_nodes
+        keys += indices[indptr[nodes] + second]
+        positions = np.minimum(np.searchsorted(edge_keys, keys), len(edge_keys) - 1)
+        closed[has_wedges] = edge_keys[positions] == keys
+        return closed
+
+    @staticmethod
+    def get_edge_keys(compact_graph):
+        # source * n + target of every directed edge, sorted, so adjacency tests are binary searches
+        sources = np.repeat(np.arange(compact_graph.number_of_nodes, dtype=np.int64), compact_graph.get_degrees())
+        return np.sort(sources * compact_graph.number_of_nodes + compact_graph.adjacency_indices)
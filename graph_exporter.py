@@ -0,0 +1,178 @@
+import gzip
+import io
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from compact_graph import CompactGraph
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class GraphExporter:
+    # Writes the node and edge tables of a CompactGraph block by block straight from its arrays, so neither
+    # table is ever turned into per-row Python objects as a whole. Parquet and Arrow need pyarrow, zstd
+    # compressed CSV needs zstandard. The binary format is raw little-endian records of NODE_DTYPE and
+    # EDGE_DTYPE, readable with np.fromfile.
+    CSV_FORMAT = "csv"
+    PARQUET_FORMAT = "parquet"
+    ARROW_FORMAT = "arrow"
+    BINARY_FORMAT = "binary"
+    GZIP_COMPRESSION = "gzip"
+    ZSTD_COMPRESSION = "zstd"
+    EXTENSIONS = {CSV_FORMAT: "csv", PARQUET_FORMAT: "parquet", ARROW_FORMAT: "arrow", BINARY_FORMAT: "bin"}
+    COMPRESSION_EXTENSIONS = {None: "", GZIP_COMPRESSION: ".gz", ZSTD_COMPRESSION: ".zst"}
+    NODE_COLUMNS = ("ID", "longitude", "latitude")
+    EDGE_COLUMNS = ("Source", "Target", "weight")
+    NODE_DTYPE = np.dtype([("ID", "<i8"), ("longitude", "<f8"), ("latitude", "<f8")])
+    EDGE_DTYPE = np.dtype([("Source", "<i8"), ("Target", "<i8"), ("weight", "<f4")])
+    ROWS_PER_BLOCK = 1 << 20
+
+    def __init__(self, file_format=CSV_FORMAT, compression=None, concurrent=True):
+        if file_format not in GraphExporter.EXTENSIONS:
+            raise ValueError(f"unknown export format: {file_format}")
+        if compression not in GraphExporter.COMPRESSION_EXTENSIONS:
+            raise ValueError(f"unknown compression: {compression}")
+        if compression is not None and file_format != GraphExporter.CSV_FORMAT:
+            raise ValueError(f"compression only applies to {GraphExporter.CSV_FORMAT} exports")
+        if file_format in (GraphExporter.PARQUET_FORMAT, GraphExporter.ARROW_FORMAT) and pa is None:
+            raise ImportError(f"exporting to {file_format} needs pyarrow")
+        if compression == GraphExporter.ZSTD_COMPRESSION and zstandard is None:
+            raise ImportError("zstd compression needs zstandard")
+        self.file_format = file_format
+        self.compression = compression
+        self.concurrent = concurrent
+
+    def export(self, graph, directory, prefix=""):
+        # graph is a CompactGraph or a networkx graph with the Graph node fields; returns the paths of the
+        # nodes and edges files, written at the same time when concurrent
+        if isinstance(graph, CompactGraph):
+            node_blocks, edge_blocks = self.iter_node_blocks(graph), self.iter_edge_blocks(graph)
+        else:
+            node_blocks, edge_blocks = self.iter_networkx_node_blocks(graph), self.iter_networkx_edge_blocks(graph)
+        extension = GraphExporter.EXTENSIONS[self.file_format] + GraphExporter.COMPRESSION_EXTENSIONS[self.compression]
+        nodes_file = os.path.join(directory, f"{prefix}nodes.{extension}")
+        edges_file = os.path.join(directory, f"{prefix}edges.{extension}")
+        tables = [
+            (nodes_file, GraphExporter.NODE_COLUMNS, GraphExporter.NODE_DTYPE, node_blocks),
+            (edges_file, GraphExporter.EDGE_COLUMNS, GraphExporter.EDGE_DTYPE, edge_blocks),
+        ]
+        if self.concurrent:
+            with ThreadPoolExecutor(max_workers=len(tables)) as executor:
+                for future in [executor.submit(self.write_table, *table) for table in tables]:
+                    future.result()
+        else:
+            for table in tables:
+                self.write_table(*table)
+        return nodes_file, edges_file
+
+    @staticmethod
+    def iter_node_blocks(compact_graph):
+        for start in range(0, compact_graph.number_of_nodes, GraphExporter.ROWS_PER_BLOCK):
+            end = start + GraphExporter.ROWS_PER_BLOCK
+            yield (
+                np.asarray(compact_graph.node_ids[start:end]),
+                np.asarray(compact_graph.longitudes[start:end]),
+                np.asarray(compact_graph.latitudes[start:end]),
+            )
+
+    @staticmethod
+    def iter_edge_blocks(compact_graph):
+        # every undirected edge once, in CompactGraph.get_edges order, over ranges of nodes holding
+        # about ROWS_PER_BLOCK adjacency entries each
+        indptr = np.asarray(compact_graph.adjacency_indptr)
+        start = 0
+        while start < compact_graph.number_of_nodes:
+            end = int(np.searchsorted(indptr, indptr[start] + GraphExporter.ROWS_PER_BLOCK, side='right')) - 1
+            end = min(max(end, start + 1), compact_graph.number_of_nodes)
+            sources = np.repeat(np.arange(start, end), np.diff(indptr[start:end + 1]))
+            targets = np.asarray(compact_graph.adjacency_indices[indptr[start]:indptr[end]])
+            weights = np.asarray(compact_graph.adjacency_weights[indptr[start]:indptr[end]])
+            upper = targets > sources
+            yield compact_graph.node_ids[sources[upper]], compact_graph.node_ids[targets[upper]], weights[upper]
+            start = end
+
+    @staticmethod
+    def iter_networkx_node_blocks(graph):
+        nodes = iter(graph.nodes(data=True))
+        while block := list(itertools.islice(nodes, GraphExporter.ROWS_PER_BLOCK)):
+            yield (
+                np.array([int(node) for node, _ in block], dtype=np.int64),
+                np.array([float(data[CompactGraph.LONGITUDE_FIELD]) for _, data in block], dtype=np.float64),
+                np.array([float(data[CompactGraph.LATITUDE_FIELD]) for _, data in block], dtype=np.float64),
+            )
+
+    @staticmethod
+    def iter_networkx_edge_blocks(graph):
+        # weights stay float64 here, so the csv keeps every digit networkx holds
+        edges = iter(graph.edges(data="weight"))
+        while block := list(itertools.islice(edges, GraphExporter.ROWS_PER_BLOCK)):
+            yield (
+                np.array([int(source) for source, _, _ in block], dtype=np.int64),
+                np.array([int(target) for _, target, _ in block], dtype=np.int64),
+                np.array([weight for _, _, weight in block], dtype=np.float64),
+            )
+
+    def write_table(self, file_address, columns, dtype, blocks):
+        writers = {
+            GraphExporter.CSV_FORMAT: self.__write_csv,
+            GraphExporter.PARQUET_FORMAT: self.__write_parquet,
+            GraphExporter.ARROW_FORMAT: self.__write_arrow,
+            GraphExporter.BINARY_FORMAT: self.__write_binary,
+        }
+        writers[self.file_format](file_address, columns, dtype, blocks)
+
+    def __write_csv(self, file_address, columns, dtype, blocks):
+        # values are written as their shortest round-trip strings, the same text csv.writer gives them
+        with self.__open_text(file_address) as file:
+            file.write(",".join(columns) + "\r\n")
+            for block in blocks:
+                rows = map(",".join, zip(*(column.astype(str).tolist() for column in block)))
+                file.write("\r\n".join(rows) + "\r\n" if len(block[0]) > 0 else "")
+
+    def __open_text(self, file_address):
+        if self.compression == GraphExporter.GZIP_COMPRESSION:
+            return gzip.open(file_address, 'wt', newline='')
+        if self.compression == GraphExporter.ZSTD_COMPRESSION:
+            binary_file = zstandard.ZstdCompressor().stream_writer(open(file_address, 'wb'), closefd=True)
+            return io.TextIOWrapper(binary_file, newline='')
+        return open(file_address, 'w', newline='')
+
+    @staticmethod
+    def __write_parquet(file_address, columns, dtype, blocks):
+        schema = GraphExporter.__get_arrow_schema(columns, dtype)
+        with pq.ParquetWriter(file_address, schema) as writer:
+            for block in blocks:
+                writer.write_table(pa.Table.from_arrays(list(block), schema=schema))
+
+    @staticmethod
+    def __write_arrow(file_address, columns, dtype, blocks):
+        schema = GraphExporter.__get_arrow_schema(columns, dtype)
+        with pa.OSFile(file_address, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+            for block in blocks:
+                writer.write_batch(pa.RecordBatch.from_arrays(list(block), schema=schema))
+
+    @staticmethod
+    def __get_arrow_schema(columns, dtype):
+        return pa.schema([(column, pa.from_numpy_dtype(dtype[column])) for column in columns])
+
+    @staticmethod
+    def __write_binary(file_address, columns, dtype, blocks):
+        with open(file_address, 'wb') as file:
+            for block in blocks:
+                records = np.empty(len(block[0]), dtype=dtype)
+                for column, values in zip(columns, block):
+                    records[column] = values
+                records.tofile(file)
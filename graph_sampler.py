@@ -0,0 +1,169 @@
+import collections
+import copy
+
+import networkx as nx
+import numpy as np
+
+from compact_graph import CompactGraph
+
+
+class GraphSampler:
+    # Samples nodes of a Graph from its CSR adjacency and returns the subgraph they induce, with every
+    # sampled node kept even when none of its neighbors was sampled. Building the subgraph only visits the
+    # sampled nodes' adjacency, read from the compact graph unless the networkx graph is already built.
+    # Each sampler has its own random generator, so runs with the same seed repeat.
+    UNIFORM = "uniform"
+    DEGREE_STRATIFIED = "degree_stratified"
+    RANDOM_WALK = "random_walk"
+    SNOWBALL = "snowball"
+    JUMP_PROBABILITY = 0.15  # chance a random walk step jumps to a uniformly drawn node instead
+
+    def __init__(self, graph, seed=None):
+        self.graph = graph
+        self.rng = np.random.default_rng(seed)
+
+    def sample(self, num_of_nodes, strategy=UNIFORM, copy_metadata=False):
+        # copy_metadata deep-copies the venue ratings and followings, otherwise they are shared with the graph
+        return self.get_induced_subgraph(self.sample_nodes(num_of_nodes, strategy), copy_metadata)
+
+    def sample_nodes(self, num_of_nodes, strategy=UNIFORM):
+        # sorted node indices of the compact graph
+        if num_of_nodes > self.graph.compact_graph.number_of_nodes:
+            raise ValueError(f"cannot sample {num_of_nodes} nodes out of {self.graph.compact_graph.number_of_nodes}")
+        samplers = {
+            GraphSampler.UNIFORM: self.__sample_uniform,
+            GraphSampler.DEGREE_STRATIFIED: self.__sample_degree_stratified,
+            GraphSampler.RANDOM_WALK: self.__sample_random_walk,
+            GraphSampler.SNOWBALL: self.__sample_snowball,
+        }
+        if strategy not in samplers:
+            raise ValueError(f"unknown sampling strategy: {strategy}")
+        return np.sort(np.asarray(samplers[strategy](num_of_nodes), dtype=np.int64))
+
+    def get_induced_subgraph(self, node_indices, copy_metadata=False):
+        # metadata is only shared with a networkx graph that already exists, from the compact graph it is new
+        if not self.graph.is_hydrated:
+            return self.__get_compact_induced_subgraph(np.sort(np.asarray(node_indices, dtype=np.int64)))
+        nodes = self.graph.compact_graph.node_ids[node_indices].tolist()
+        sampled = set(nodes)
+        subgraph = nx.Graph()
+        for node in nodes:
+            attributes = self.graph.graph.nodes[node]
+            subgraph.add_node(node, **(copy.deepcopy(attributes) if copy_metadata else attributes))
+        for node in nodes:
+            for neighbor, edge_data in self.graph.graph.adj[node].items():
+                if neighbor in sampled and not subgraph.has_edge(node, neighbor):
+                    subgraph.add_edge(node, neighbor, weight=edge_data["weight"])
+        return subgraph
+
+    def __get_compact_induced_subgraph(self, node_indices):
+        compact_graph = self.graph.compact_graph
+        node_ids = compact_graph.node_ids[node_indices].tolist()
+        venue_ids = np.asarray(compact_graph.venue_ids)
+        rating_lengths, rating_positions = GraphSampler.__get_rows(compact_graph.rating_indptr, node_indices)
+        rating_venue_ids = venue_ids[compact_graph.rating_venue_indices[rating_positions]].tolist()
+        rates = compact_graph.rating_rates[rating_positions].tolist()
+        following_lengths, following_positions = GraphSampler.__get_rows(compact_graph.following_indptr, node_indices)
+        following_ids = compact_graph.node_ids[compact_graph.following_indices[following_positions]].tolist()
+        rating_bounds = np.concatenate([[0], np.cumsum(rating_lengths)]).tolist()
+        following_bounds = np.concatenate([[0], np.cumsum(following_lengths)]).tolist()
+        longitudes = compact_graph.longitudes[node_indices].tolist()
+        latitudes = compact_graph.latitudes[node_indices].tolist()
+        has_followings = compact_graph.has_followings[node_indices].tolist()
+
+        subgraph = nx.Graph()
+        for position, node in enumerate(node_ids):
+            start, end = rating_bounds[position], rating_bounds[position + 1]
+            followings = None
+            if has_followings[position]:
+                followings = set(following_ids[following_bounds[position]:following_bounds[position + 1]])
+            subgraph.add_node(node, **{
+                CompactGraph.VENUE_METADATA_FIELD: dict(zip(rating_venue_ids[start:end], rates[start:end])),
+                CompactGraph.LONGITUDE_FIELD: longitudes[position],
+                CompactGraph.LATITUDE_FIELD: latitudes[position],
+                CompactGraph.FOLLOWING_METADATA_FIELD: followings,
+            })
+
+        # every edge once, from its lower node index, between two sampled nodes
+        adjacency_lengths, adjacency_positions = GraphSampler.__get_rows(compact_graph.adjacency_indptr, node_indices)
+        sources = np.repeat(node_indices, adjacency_lengths)
+        targets = np.asarray(compact_graph.adjacency_indices[adjacency_positions], dtype=np.int64)
+        found = np.minimum(np.searchsorted(node_indices, targets), max(len(node_indices) - 1, 0))
+        kept = (targets > sources) & (node_indices[found] == targets) if len(node_indices) > 0 else targets > sources
+        subgraph.add_weighted_edges_from(zip(
+            compact_graph.node_ids[sources[kept]].tolist(),
+            compact_graph.node_ids[targets[kept]].tolist(),
+            CompactGraph.get_weight_values(compact_graph.adjacency_weights[adjacency_positions[kept]])
+        ))
+        return subgraph
+
+    @staticmethod
+    def __get_rows(indptr, rows):
+        # lengths of the given CSR rows and the positions of their entries, row after row
+        starts = np.asarray(indptr[rows], dtype=np.int64)
+        lengths = np.asarray(indptr[rows + 1], dtype=np.int64) - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return lengths, np.arange(int(lengths.sum()), dtype=np.int64) + offsets
+
+    def __sample_uniform(self, num_of_nodes):
+        return self.rng.choice(self.graph.compact_graph.number_of_nodes, num_of_nodes, replace=False)
+
+    def __sample_degree_stratified(self, num_of_nodes):
+        # nodes are split into strata by log2(degree) and every stratum gets its proportional share of the
+        # sample (largest remainders get the rounding), so the sample keeps the degree distribution
+        degrees = self.graph.compact_graph.get_degrees()
+        strata = np.floor(np.log2(np.maximum(degrees, 1))).astype(np.int64)
+        stratum_sizes = np.bincount(strata)
+        shares = stratum_sizes * num_of_nodes / len(degrees)
+        allocations = np.floor(shares).astype(np.int64)
+        remainders = np.argsort(allocations - shares, kind='stable')[:num_of_nodes - allocations.sum()]
+        allocations[remainders] += 1
+
+        order = np.argsort(strata, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(stratum_sizes)])
+        return np.concatenate([
+            self.rng.choice(order[bounds[stratum]:bounds[stratum + 1]], allocation, replace=False)
+            for stratum, allocation in enumerate(allocations.tolist())
+        ])
+
+    def __sample_random_walk(self, num_of_nodes):
+        # a walk that jumps to a uniformly drawn node now and then (and from nodes without neighbors),
+        # so it can leave small components; nodes are sampled in the order it first visits them
+        compact_graph = self.graph.compact_graph
+        indptr = np.asarray(compact_graph.adjacency_indptr)
+        indices = np.asarray(compact_graph.adjacency_indices)
+        visited = np.zeros(compact_graph.number_of_nodes, dtype=np.bool_)
+        sampled = []
+        node = int(self.rng.integers(compact_graph.number_of_nodes))
+        while len(sampled) < num_of_nodes:
+            if not visited[node]:
+                visited[node] = True
+                sampled.append(node)
+            degree = indptr[node + 1] - indptr[node]
+            if degree == 0 or self.rng.random() < GraphSampler.JUMP_PROBABILITY:
+                node = int(self.rng.integers(compact_graph.number_of_nodes))
+            else:
+                node = int(indices[indptr[node] + self.rng.integers(degree)])
+        return sampled
+
+    def __sample_snowball(self, num_of_nodes):
+        # breadth-first waves from a random node, each node's unseen neighbors join in random order;
+        # when a component runs out, the next wave starts from another random node
+        compact_graph = self.graph.compact_graph
+        indptr = np.asarray(compact_graph.adjacency_indptr)
+        indices = np.asarray(compact_graph.adjacency_indices)
+        seen = np.zeros(compact_graph.number_of_nodes, dtype=np.bool_)
+        sampled = []
+        starts = iter(self.rng.permutation(compact_graph.number_of_nodes).tolist())
+        while len(sampled) < num_of_nodes:
+            start = next(start for start in starts if not seen[start])
+            seen[start] = True
+            queue = collections.deque([start])
+            while queue and len(sampled) < num_of_nodes:
+                node = queue.popleft()
+                sampled.append(node)
+                neighbors = indices[indptr[node]:indptr[node + 1]]
+                neighbors = self.rng.permutation(neighbors[~seen[neighbors]])
+                seen[neighbors] = True
+                queue.extend(neighbors.tolist())
+        return sampled
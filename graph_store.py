@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from compact_graph import CompactGraph
+
+
+class GraphStore:
+    # On-disk form of a CompactGraph: one .npy file per array, so a store can be memory-mapped
+    # and only turned into an nx.Graph when something actually needs one.
+    # Every save writes its arrays into a new directory and then atomically replaces CURRENT_FILE_NAME,
+    # which names it, so arrays a reader has memory-mapped are never written over and a save cut short
+    # leaves the previous store (or none) in place. A store without CURRENT_FILE_NAME is not complete.
+    CURRENT_FILE_NAME = "current"
+    ARRAYS_DIRECTORY_PREFIX = "arrays."
+
+    @staticmethod
+    def save(compact_graph, directory):
+        os.makedirs(directory, exist_ok=True)
+        arrays_directory = tempfile.mkdtemp(dir=directory, prefix=GraphStore.ARRAYS_DIRECTORY_PREFIX)
+        current = tempfile.NamedTemporaryFile(
+            'w', dir=directory, prefix=f".{GraphStore.CURRENT_FILE_NAME}.", delete=False
+        )
+        try:
+            for name in CompactGraph.ARRAY_NAMES:
+                np.save(os.path.join(arrays_directory, f"{name}.npy"), getattr(compact_graph, name))
+            current.write(os.path.basename(arrays_directory))
+            current.close()
+            os.replace(current.name, os.path.join(directory, GraphStore.CURRENT_FILE_NAME))
+        except BaseException:
+            current.close()
+            os.remove(current.name)
+            shutil.rmtree(arrays_directory, ignore_errors=True)
+            raise
+        # arrays of earlier saves, the ones still memory-mapped stay readable until they are unmapped
+        for entry in os.listdir(directory):
+            if entry.startswith(GraphStore.ARRAYS_DIRECTORY_PREFIX) and entry != os.path.basename(arrays_directory):
+                shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+    @staticmethod
+    def open(directory):
+        arrays_directory = GraphStore.get_arrays_directory(directory)
+        return CompactGraph(**{
+            name: np.load(os.path.join(arrays_directory, f"{name}.npy"), mmap_mode='r')
+            for name in CompactGraph.ARRAY_NAMES
+        })
+
+    @staticmethod
+    def exists(directory):
+        if not os.path.isfile(os.path.join(directory, GraphStore.CURRENT_FILE_NAME)):
+            return False
+        arrays_directory = GraphStore.get_arrays_directory(directory)
+        return all(os.path.isfile(os.path.join(arrays_directory, f"{name}.npy")) for name in CompactGraph.ARRAY_NAMES)
+
+    @staticmethod
+    def get_arrays_directory(directory):
+        with open(os.path.join(directory, GraphStore.CURRENT_FILE_NAME), 'r') as file:
+            return os.path.join(directory, file.read().strip())
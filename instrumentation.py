@@ -0,0 +1,201 @@
+import atexit
+import contextlib
+import functools
+import json
+import os
+import resource
+import threading
+import time
+
+# Spans are only recorded when this is set to 1 (or after enable()), otherwise they cost a flag check.
+# With GRAPH_INSTRUMENTATION_OUTPUT set, the records are dumped there when the process exits, as plain json
+# or, with GRAPH_INSTRUMENTATION_FORMAT=chrome, as a trace for chrome://tracing / Perfetto.
+ENABLED_ENV_VAR = "GRAPH_INSTRUMENTATION"
+OUTPUT_ENV_VAR = "GRAPH_INSTRUMENTATION_OUTPUT"
+FORMAT_ENV_VAR = "GRAPH_INSTRUMENTATION_FORMAT"
+JSON_FORMAT = "json"
+CHROME_FORMAT = "chrome"
+PROCESS_SCOPE = "process"
+THREAD_SCOPE = "thread"
+
+_enabled = False
+_records = []
+_records_lock = threading.Lock()
+_local = threading.local()
+_origin = time.perf_counter()
+
+
+class Span:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.counts = {}
+        self.peak_rss = 0
+
+    @property
+    def enabled(self):
+        return True
+
+    def add_count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+
+class DisabledSpan:
+    @property
+    def enabled(self):
+        return False
+
+    def add_count(self, name, amount=1):
+        pass
+
+
+_disabled_span = DisabledSpan()
+
+
+def enable(output=None, trace_format=JSON_FORMAT):
+    global _enabled
+    _enabled = True
+    if output is not None:
+        atexit.register(dump, output, trace_format)
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _records_lock:
+        _records.clear()
+
+
+def get_records():
+    with _records_lock:
+        return list(_records)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    # Records the wall time, CPU time and peak RSS of the block, plus whatever counts it adds to the span.
+    # Only main thread spans reset the peak RSS (the reset is process-wide) and time the whole process's CPU,
+    # a span takes over the peak its children reached. Spans of other threads may run next to each other, so
+    # they time their own thread's CPU (cpu_scope "thread") and report the process's peak since the last reset.
+    if not _enabled:
+        yield _disabled_span
+        return
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    if stack:
+        stack[-1].peak_rss = max(stack[-1].peak_rss, get_peak_rss())
+    current = Span(name, attributes)
+    stack.append(current)
+    is_main_thread = threading.current_thread() is threading.main_thread()
+    if is_main_thread:
+        reset_peak_rss()
+    cpu_clock = time.process_time if is_main_thread else time.thread_time
+    cpu_start = cpu_clock()
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        end = time.perf_counter()
+        cpu_time = cpu_clock() - cpu_start
+        stack.pop()
+        current.peak_rss = max(current.peak_rss, get_peak_rss())
+        if stack:
+            stack[-1].peak_rss = max(stack[-1].peak_rss, current.peak_rss)
+        record = {
+            "name": name,
+            "start": start - _origin,
+            "wall_time": end - start,
+            "cpu_time": cpu_time,
+            "cpu_scope": PROCESS_SCOPE if is_main_thread else THREAD_SCOPE,
+            "peak_rss_mb": current.peak_rss / 1024,
+            "counts": current.counts,
+            "attributes": current.attributes,
+            "depth": len(stack),
+            "pid": os.getpid(),
+            "thread": threading.get_ident(),
+        }
+        with _records_lock:
+            _records.append(record)
+
+
+def instrumented(name=None, counts=None):
+    # Decorator form of span. counts maps the function's result to {count name: amount}.
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with span(span_name) as current:
+                result = function(*args, **kwargs)
+                if counts is not None:
+                    for count_name, amount in counts(result).items():
+                        current.add_count(count_name, amount)
+                return result
+        return wrapper
+    return decorator
+
+
+def dump(file_address, trace_format=JSON_FORMAT):
+    records = get_records()
+    if trace_format == CHROME_FORMAT:
+        content = {"traceEvents": [get_trace_event(record) for record in records], "displayTimeUnit": "ms"}
+    elif trace_format == JSON_FORMAT:
+        content = {"records": records}
+    else:
+        raise ValueError(f"unknown instrumentation format: {trace_format}")
+    with open(file_address, 'w') as file:
+        json.dump(content, file, indent=2)
+
+
+def get_trace_event(record):
+    # a complete ("X") event, chrome traces count in microseconds
+    return {
+        "name": record["name"],
+        "ph": "X",
+        "ts": record["start"] * 1e6,
+        "dur": record["wall_time"] * 1e6,
+        "pid": record["pid"],
+        "tid": record["thread"],
+        "args": {
+            "cpu_time": record["cpu_time"],
+            "cpu_scope": record["cpu_scope"],
+            "peak_rss_mb": record["peak_rss_mb"],
+            **record["counts"],
+            **record["attributes"],
+        },
+    }
+
+
+def reset_peak_rss():
+    # Linux lets a process reset its own peak RSS, elsewhere the peak stays the process-wide one
+    try:
+        with open("/proc/self/clear_refs", 'w') as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def get_peak_rss():
+    # in kB
+    try:
+        with open("/proc/self/status", 'r') as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+if os.environ.get(ENABLED_ENV_VAR) == "1":
+    enable(os.environ.get(OUTPUT_ENV_VAR), os.environ.get(FORMAT_ENV_VAR, JSON_FORMAT))
@@ -16,9 +16,9 @@ graph.read_graph()
 print(nx.info(graph.graph))
 
 graph.plotDegDistLogLog()
-x= nx.number_connected_components(graph.graph)
+x = graph.get_number_of_connected_components()
 print("number of connected components is:", x)
-print("average of clustering is: ",nx.average_clustering(graph.graph))
+print("average of clustering is: ", graph.get_average_clustering())
 graph.plot_clustring()
 
 
@@ -0,0 +1,104 @@
+import contextlib
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+
+import numpy as np
+
+from instrumentation import span
+
+
+class MetricsCache:
+    # Results of graph metrics in a SQLite file, keyed by a fingerprint of the metric's inputs (a content hash,
+    # see get_fingerprint), the metric's name and its parameters, so a result is reused until any of them
+    # changes. Once the pickled results pass max_bytes, the least recently used ones are evicted. Every call
+    # opens its own connection, so worker processes can share a cache.
+    FILE_NAME = "metrics_cache.sqlite"
+    MAX_BYTES = 256 << 20
+    TIMEOUT = 30  # seconds to wait for another process's write
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        self.file_address = os.path.join(directory, self.FILE_NAME)
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        with self.__connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS metrics "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used INTEGER NOT NULL)"
+            )
+
+    def get_or_compute(self, fingerprint, metric, parameters, compute):
+        # parameters is anything json can hold, compute is only called on a miss and its result must pickle
+        key = MetricsCache.get_key(fingerprint, metric, parameters)
+        with span("metrics_cache", metric=metric) as current:
+            with self.__connect() as connection:
+                row = connection.execute("SELECT value FROM metrics WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE metrics SET last_used = ? WHERE key = ?", (time.time_ns(), key))
+            if row is not None:
+                current.add_count("hits")
+                return pickle.loads(row[0])
+            current.add_count("misses")
+            value = compute()
+            self.put(key, value)
+            return value
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        with self.__connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?)", (key, data, len(data), time.time_ns())
+            )
+            self.__evict(connection)
+
+    def clear(self):
+        with self.__connect() as connection:
+            connection.execute("DELETE FROM metrics")
+
+    def get_size(self):
+        with self.__connect() as connection:
+            return connection.execute("SELECT COALESCE(SUM(size), 0) FROM metrics").fetchone()[0]
+
+    def __evict(self, connection):
+        rows = connection.execute("SELECT key, size FROM metrics ORDER BY last_used DESC").fetchall()
+        total = 0
+        evicted = []
+        for key, size in rows:
+            total += size
+            if total > self.max_bytes:
+                evicted.append((key,))
+        connection.executemany("DELETE FROM metrics WHERE key = ?", evicted)
+
+    @contextlib.contextmanager
+    def __connect(self):
+        # commits (or rolls back) and closes, sqlite3's own context manager only does the former
+        connection = sqlite3.connect(self.file_address, timeout=self.TIMEOUT)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def get_key(fingerprint, metric, parameters):
+        description = json.dumps([fingerprint, metric, parameters], sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    @staticmethod
+    def get_fingerprint(*inputs):
+        # hash of the given arrays (dtype, shape and content, memory-mapped ones are read through once)
+        # and of the repr of anything else
+        digest = hashlib.blake2b(digest_size=20)
+        for value in inputs:
+            if isinstance(value, np.ndarray):
+                digest.update(f"{value.dtype.str}{value.shape}".encode())
+                digest.update(memoryview(np.ascontiguousarray(value)).cast('B'))
+            else:
+                digest.update(repr(value).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
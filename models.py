@@ -1,13 +1,23 @@
+import datetime
+import itertools
+import os
+import warnings
 from typing import List, Tuple
 
-from turfpy.measurement import boolean_point_in_polygon
-from geojson import Point, Polygon, Feature
+import numpy as np
+
+from geo import points_in_polygon, RegionGrid
+from instrumentation import instrumented, span
 
 
 class User:
+    __slots__ = ("identifier", "long", "lat")
     ID_INDEX = 0
     LAT_INDEX = 1
     LONG_INDEX = 2
+    # fields in __init__ order and the text file column each is read from, see RecordBatch
+    DTYPE = np.dtype([("identifier", np.int64), ("long", np.float64), ("lat", np.float64)])
+    COLUMNS = (ID_INDEX, LONG_INDEX, LAT_INDEX)
 
     def __init__(self, identifier, long, lat):
         self.identifier = identifier
@@ -27,22 +37,16 @@ class User:
 
     @staticmethod
     def read_users(file_addr):
-        result = []
-        with open(file_addr, 'r') as file:
-            for line in file.readlines():
-                inputs = line.split()
-                result.append(User(
-                    identifier=inputs[User.ID_INDEX],
-                    long=inputs[User.LONG_INDEX],
-                    lat=inputs[User.LAT_INDEX]
-                ))
-        return result
+        return RecordBatch.read(file_addr, User).to_records()
 
 
 class Venue:
+    __slots__ = ("identifier", "long", "lat")
     ID_INDEX = 0
     LAT_INDEX = 1
     LONG_INDEX = 2
+    DTYPE = np.dtype([("identifier", np.int64), ("long", np.float64), ("lat", np.float64)])
+    COLUMNS = (ID_INDEX, LONG_INDEX, LAT_INDEX)
 
     def __init__(self, identifier, long, lat):
         self.identifier = identifier
@@ -62,22 +66,16 @@ class Venue:
 
     @staticmethod
     def read_venues(file_addr):
-        result = []
-        with open(file_addr, 'r') as file:
-            for line in file.readlines():
-                inputs = line.split()
-                result.append(Venue(
-                    identifier=inputs[Venue.ID_INDEX],
-                    long=inputs[Venue.LONG_INDEX],
-                    lat=inputs[Venue.LAT_INDEX]
-                ))
-        return result
+        return RecordBatch.read(file_addr, Venue).to_records()
 
 
 class Rating:
+    __slots__ = ("user_id", "venue_id", "rate")
     USER_ID_INDEX = 0
     VENUE_ID_INDEX = 1
     RATE_INDEX = 2
+    DTYPE = np.dtype([("user_id", np.int64), ("venue_id", np.int64), ("rate", np.uint8)])
+    COLUMNS = (USER_ID_INDEX, VENUE_ID_INDEX, RATE_INDEX)
 
     def __init__(self, user_id, venue_id, rate):
         self.user_id = user_id
@@ -97,25 +95,26 @@ class Rating:
 
     @staticmethod
     def read_ratings(file_addr):
-        result = []
-        with open(file_addr, 'r') as file:
-            for line in file.readlines():
-                inputs = line.split()
-                result.append(Rating(
-                    user_id=inputs[Rating.USER_ID_INDEX],
-                    venue_id=inputs[Rating.VENUE_ID_INDEX],
-                    rate=inputs[Rating.RATE_INDEX]
-                ))
-        return result
+        return RecordBatch.read(file_addr, Rating).to_records()
 
 
 class Checkin:
+    __slots__ = ("identifier", "user_id", "venue_id", "long", "lat", "created_at")
     ID_INDEX = 0
     USER_ID_INDEX = 1
     VENUE_ID_INDEX = 2
     LAT_INDEX = 3
     LONG_INDEX = 4
     CREATED_AT_INDEX = 5
+    DTYPE = np.dtype([
+        ("identifier", np.int64),
+        ("user_id", np.int64),
+        ("venue_id", np.int64),
+        ("long", np.float64),
+        ("lat", np.float64),
+        ("created_at", "datetime64[s]"),
+    ])
+    COLUMNS = (ID_INDEX, USER_ID_INDEX, VENUE_ID_INDEX, LONG_INDEX, LAT_INDEX, CREATED_AT_INDEX)
 
     def __init__(self, identifier, user_id, venue_id, long, lat, created_at):
         self.identifier = identifier
@@ -136,13 +135,20 @@ class Checkin:
             venue_id=int(inputs[Checkin.VENUE_ID_INDEX]),
             lat=float(inputs[Checkin.LAT_INDEX]),
             long=float(inputs[Checkin.LONG_INDEX]),
-            created_at=inputs[Checkin.CREATED_AT_INDEX],
+            created_at=datetime.datetime.fromisoformat(inputs[Checkin.CREATED_AT_INDEX]),
         )
 
+    @staticmethod
+    def read_checkins(file_addr):
+        return RecordBatch.read(file_addr, Checkin).to_records()
+
 
 class Friendship:
+    __slots__ = ("first", "second")
     FIRST_INDEX = 0
     SECOND_INDEX = 1
+    DTYPE = np.dtype([("first", np.int64), ("second", np.int64)])
+    COLUMNS = (FIRST_INDEX, SECOND_INDEX)
 
     def __init__(self, first, second):
         self.first = first
@@ -154,27 +160,91 @@ class Friendship:
     @staticmethod
     def create_from_raw_inputs(inputs):
         return Friendship(
-            first=inputs[Friendship.FIRST_INDEX],
-            second=inputs[Friendship.SECOND_INDEX],
+            first=int(inputs[Friendship.FIRST_INDEX]),
+            second=int(inputs[Friendship.SECOND_INDEX]),
         )
 
     @staticmethod
     def read_friendships(file_addr):
-        result = []
-        with open(file_addr, 'r') as file:
-            for line in file.readlines():
-                inputs = line.split()
-                result.append(Friendship(
-                    first=inputs[Friendship.FIRST_INDEX],
-                    second=inputs[Friendship.SECOND_INDEX]
-                ))
-        return result
+        return RecordBatch.read(file_addr, Friendship).to_records()
 
 
-def read_data(file_address, model_class):
-    data = []
+class RecordBatch:
+    # The records of a text data file as one typed array per field (the model's DTYPE), parsed by a single
+    # np.loadtxt call instead of a Python object per line. Integers are parsed as int64 and range-checked
+    # before they are narrowed. A datetime field spans two columns of the file, the date and the time
+    # get_string writes with a space between them; only whole-second times without a zone are accepted.
+    DATETIME_TEXT_DTYPE = "U32"
+    DATE_LENGTH = 10
+    TIME_LENGTH = 8
+
+    def __init__(self, model_class, columns):
+        self.model_class = model_class
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns[self.model_class.DTYPE.names[0]])
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def to_records(self):
+        # the values come back as Python ints, floats and datetimes, the types create_from_raw_inputs gives
+        fields = (self.columns[name].tolist() for name in self.model_class.DTYPE.names)
+        return [self.model_class(*values) for values in zip(*fields)]
+
+    @staticmethod
+    def read(file_address, model_class):
+        text_fields = []
+        for name, column in zip(model_class.DTYPE.names, model_class.COLUMNS):
+            if model_class.DTYPE[name].kind == 'M':
+                text_fields.append((f"{name}_date", RecordBatch.DATETIME_TEXT_DTYPE, column))
+                text_fields.append((f"{name}_time", RecordBatch.DATETIME_TEXT_DTYPE, column + 1))
+            elif model_class.DTYPE[name].kind in 'iu':
+                text_fields.append((name, np.int64, column))
+            else:
+                text_fields.append((name, model_class.DTYPE[name], column))
+        with warnings.catch_warnings():
+            # an empty file is an empty batch, not worth numpy's warning
+            warnings.simplefilter("ignore", UserWarning)
+            rows = np.loadtxt(
+                file_address,
+                dtype=[(name, dtype) for name, dtype, _ in text_fields],
+                usecols=[column for _, _, column in text_fields],
+                ndmin=1,
+            )
+
+        columns = {}
+        for name in model_class.DTYPE.names:
+            if model_class.DTYPE[name].kind == 'M':
+                dates, times = rows[f"{name}_date"], rows[f"{name}_time"]
+                malformed = (np.char.str_len(dates) != RecordBatch.DATE_LENGTH) | (
+                    np.char.str_len(times) != RecordBatch.TIME_LENGTH
+                )
+                if malformed.any():
+                    row = int(np.flatnonzero(malformed)[0])
+                    raise ValueError(f"{file_address}: unsupported {name} {dates[row]} {times[row]} in row {row + 1}")
+                columns[name] = np.char.add(np.char.add(dates, "T"), times).astype(model_class.DTYPE[name])
+            elif model_class.DTYPE[name].kind in 'iu':
+                values = rows[name]
+                limits = np.iinfo(model_class.DTYPE[name])
+                out_of_range = (values < limits.min) | (values > limits.max)
+                if out_of_range.any():
+                    row = int(np.flatnonzero(out_of_range)[0])
+                    raise ValueError(f"{file_address}: {name} {values[row]} in row {row + 1} is out of range")
+                columns[name] = values.astype(model_class.DTYPE[name])
+            else:
+                columns[name] = np.ascontiguousarray(rows[name])
+        return RecordBatch(model_class, columns)
+
+
+CHUNK_SIZE = 100000
+HEADER_LINES = 2
+
+
+def iter_data(file_address, model_class):
     with open(file_address, 'r') as file:
-        for line in file.readlines()[2:]:
+        for line in itertools.islice(file, HEADER_LINES, None):
             record_data = [column.strip() for column in line.split("|")]
             not_standard = False
             for column in record_data:
@@ -182,102 +252,182 @@ def read_data(file_address, model_class):
                     not_standard = True
             if not_standard:
                 continue
-            data.append(model_class.create_from_raw_inputs(inputs=record_data))
-    return data
+            yield model_class.create_from_raw_inputs(inputs=record_data)
+
+
+def iter_data_chunks(file_address, model_class, chunk_size=CHUNK_SIZE):
+    records = iter_data(file_address, model_class)
+    chunk = list(itertools.islice(records, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(records, chunk_size))
+
+
+@instrumented(counts=lambda records: {"records": len(records)})
+def read_data(file_address, model_class):
+    return list(iter_data(file_address, model_class))
 
 
 def limit_data_by_location(polygon_coords: List[List[Tuple]], model_records):
-    polygon = Polygon(polygon_coords)
-    result = []
-    for record in model_records:
-        if boolean_point_in_polygon(Feature(geometry=Point((record.long, record.lat))), polygon):
-            result.append(record)
-    return result
+    # polygon_coords is a Polygon's rings, or a list of Polygons for a MultiPolygon
+    with span("limit_data_by_location") as current:
+        longitudes = np.array([record.long for record in model_records], dtype=np.float64)
+        latitudes = np.array([record.lat for record in model_records], dtype=np.float64)
+        inside = points_in_polygon(longitudes, latitudes, polygon_coords)
+        current.add_count("records", len(model_records))
+        current.add_count("kept", int(inside.sum()))
+        return [record for record, is_inside in zip(model_records, inside.tolist()) if is_inside]
 
 
 def limit_records_by_user_venue(records, users, venues):
-    user_ids = set([user.identifier for user in users])
-    venues_ids = set([venue.identifier for venue in venues])
-    result = []
-    for record in records:
-        if record.user_id in user_ids and record.venue_id in venues_ids:
-            result.append(record)
-    return result
+    user_ids = get_ids(users, "identifier")
+    venues_ids = get_ids(venues, "identifier")
+    return limit_records_by_ids(records, user_ids, venues_ids)
+
+
+def limit_records_by_ids(records, user_ids, venues_ids):
+    # semi-join on int64 id columns against the region's user and venue id arrays
+    inside = np.isin(get_ids(records, "user_id"), user_ids) & np.isin(get_ids(records, "venue_id"), venues_ids)
+    return [record for record, is_inside in zip(records, inside.tolist()) if is_inside]
 
 
-def store_limited_friendships(friendships):
-    users = set()
-    with open("data/users.txt", 'r') as file:
-        for line in file.readlines():
-            users.add(line.split()[0])
+def limit_friendships_by_ids(friendships, user_ids):
+    inside = np.isin(get_ids(friendships, "first"), user_ids) & np.isin(get_ids(friendships, "second"), user_ids)
+    return [friendship for friendship, is_inside in zip(friendships, inside.tolist()) if is_inside]
 
-    with open("data/friendships.txt", 'w') as file:
-        for friendship in friendships:
-            if friendship.first in users and friendship.second in users:
-                file.write(f"{friendship.get_string()}\n")
+
+def get_ids(records, field):
+    return np.fromiter((getattr(record, field) for record in records), dtype=np.int64, count=len(records))
+
+
+def store_limited_friendships(friendships, user_ids=None, file_address="data/friendships.txt"):
+    # keeps the friendships between users of user_ids (an int64 id array), by default the users in data/users.txt
+    if user_ids is None:
+        user_ids = RecordBatch.read("data/users.txt", User)["identifier"]
+    store_records(limit_friendships_by_ids(list(friendships), user_ids), file_address)
 
 
 def store_records(records, file_address):
     with open(file_address, 'w') as file:
-        for record in records:
-            file.write(f'{record.get_string()}\n')
+        write_records(records, file)
+
+
+def write_records(records, file):
+    file.write("".join(f'{record.get_string()}\n' for record in records))
+
+
+def filter_data_file(file_address, model_class, output_name, region_dirs, regions_filter):
+    # streams the dump chunk by chunk, so only one chunk of records is in memory at a time,
+    # and writes each region's share of every chunk to <region dir>/<output_name>
+    total_records = 0
+    kept_records = {name: 0 for name in region_dirs}
+    files = {name: open(os.path.join(region_dir, output_name), 'w') for name, region_dir in region_dirs.items()}
+    with span("filter_data_file", file=file_address) as current:
+        try:
+            for chunk in iter_data_chunks(file_address, model_class):
+                total_records += len(chunk)
+                for name, records in regions_filter(chunk).items():
+                    kept_records[name] += len(records)
+                    write_records(records, files[name])
+        finally:
+            for file in files.values():
+                file.close()
+        current.add_count("records", total_records)
+        current.add_count("kept", sum(kept_records.values()))
+    return total_records, kept_records
+
+
+def clean_regions(regions, base_dir="data", region_dirs=None):
+    # regions maps a name to a Polygon's (or MultiPolygon's) coordinates; every raw dump is read once
+    # whatever the number of regions, and each region gets its own directory, <base_dir>/<name> by default
+    if region_dirs is None:
+        region_dirs = {name: os.path.join(base_dir, name) for name in regions}
+    for region_dir in region_dirs.values():
+        os.makedirs(region_dir, exist_ok=True)
+    region_grid = RegionGrid(regions)
+
+    # only the ids of the records inside the regions are kept around between files
+    region_user_ids = {name: [] for name in regions}
+    region_venue_ids = {name: [] for name in regions}
+
+    def limit_by_location(records, region_ids):
+        longitudes = np.array([record.long for record in records], dtype=np.float64)
+        latitudes = np.array([record.lat for record in records], dtype=np.float64)
+        region_records = {}
+        for name, inside in region_grid.get_regions_masks(longitudes, latitudes).items():
+            region_records[name] = [record for record, is_inside in zip(records, inside.tolist()) if is_inside]
+            region_ids[name].append(get_ids(region_records[name], "identifier"))
+        return region_records
+
+    def limit_records(records):
+        return {
+            name: limit_records_by_ids(records, region_user_ids[name], region_venue_ids[name])
+            for name in regions
+        }
+
+    def limit_friendships(friendships):
+        return {name: limit_friendships_by_ids(friendships, region_user_ids[name]) for name in regions}
+
+    users, region_users = filter_data_file(
+        "users.dat", User, "users.txt", region_dirs, lambda records: limit_by_location(records, region_user_ids)
+    )
+    venues, region_venues = filter_data_file(
+        "venues.dat", Venue, "venues.txt", region_dirs, lambda records: limit_by_location(records, region_venue_ids)
+    )
+    for name in regions:
+        region_user_ids[name] = np.unique(np.concatenate(region_user_ids[name] or [[]]).astype(np.int64))
+        region_venue_ids[name] = np.unique(np.concatenate(region_venue_ids[name] or [[]]).astype(np.int64))
+    ratings, region_ratings = filter_data_file("ratings.dat", Rating, "ratings.txt", region_dirs, limit_records)
+    checkins, region_checkins = filter_data_file("checkins.dat", Checkin, "checkins.txt", region_dirs, limit_records)
+    filter_data_file("socialgraph.dat", Friendship, "friendships.txt", region_dirs, limit_friendships)
+
+    for place_name in regions:
+        print(f"total number of users: {users}, users in {place_name}: {region_users[place_name]}")
+        print(f"total number of venues: {venues}, venues in {place_name}: {region_venues[place_name]}")
+        print(f"total number of ratings: {ratings}, ratings in {place_name}: {region_ratings[place_name]}")
+        print(f"total number of checkins: {checkins}, checkins in {place_name}: {region_checkins[place_name]}")
 
 
 def clean_data():
-    san_francisco_coords = [[
-        (-122.553454, 37.812965),
-        (-122.359602, 37.817252),
-        (-122.346337, 37.708571),
-        (-122.523607, 37.708332)
-    ]]
-
     place_name = "San Francisco"
-
-    users = read_data("users.dat", User)
-    venues = read_data("venues.dat", Venue)
-    ratings = read_data("ratings.dat", Rating)
-    checkins = read_data("checkins.dat", Checkin)
-
-    san_francisco_users = limit_data_by_location(san_francisco_coords, users)
-    san_francisco_venues = limit_data_by_location(san_francisco_coords, venues)
-    san_francisco_ratings = limit_records_by_user_venue(ratings, san_francisco_users, san_francisco_venues)
-    san_francisco_checkins = limit_records_by_user_venue(checkins, san_francisco_users, san_francisco_venues)
-
-    print(f"total number of users: {len(users)}, users in {place_name}: {len(san_francisco_users)}")
-    print(f"total number of venues: {len(venues)}, venues in {place_name}: {len(san_francisco_venues)}")
-    print(f"total number of ratings: {len(ratings)}, ratings in {place_name}: {len(san_francisco_ratings)}")
-    print(f"total number of checkins: {len(checkins)}, checkins in {place_name}: {len(san_francisco_checkins)}")
-
-    store_records(san_francisco_users, "data/users.txt")
-    store_records(san_francisco_venues, "data/venues.txt")
-    store_records(san_francisco_ratings, "data/ratings.txt")
-    store_records(san_francisco_checkins, "data/checkins.txt")
-
-    friendships = read_data("socialgraph.dat", Friendship)
-    store_limited_friendships(friendships)
-
-
-# calgary_coords = [[
-#     (-114.325419, 51.214159),  # long, lat
-#     (-113.865366, 51.214159),
-#     (-113.865366, 50.847729),
-#     (-114.325419, 50.847729),
-# ]]
-
-# alberta_coords = [[
-#     (-119.921953, 53.212140),  # long, lat
-#     (-114.548265, 49.017250),
-#     (-110.021898, 49.002837),
-#     (-110.021898, 59.994249),
-#     (-119.997483, 60.005236),
-# ]]
-
-# california_coords = [[
-#     (-124.371877, 41.990849),
-#     (-119.975840, 41.999506),
-#     (-120.002350, 38.986355),
-#     (-114.594288, 34.996728),
-#     (-114.700328, 32.729648),
-#     (-117.205534, 32.551061),
-#     (-125.953869, 35.580972)
-# ]]
+    clean_regions({place_name: SAN_FRANCISCO_COORDS}, region_dirs={place_name: "data"})
+
+
+SAN_FRANCISCO_COORDS = [[
+    (-122.553454, 37.812965),  # long, lat
+    (-122.359602, 37.817252),
+    (-122.346337, 37.708571),
+    (-122.523607, 37.708332)
+]]
+
+CALGARY_COORDS = [[
+    (-114.325419, 51.214159),  # long, lat
+    (-113.865366, 51.214159),
+    (-113.865366, 50.847729),
+    (-114.325419, 50.847729),
+]]
+
+ALBERTA_COORDS = [[
+    (-119.921953, 53.212140),  # long, lat
+    (-114.548265, 49.017250),
+    (-110.021898, 49.002837),
+    (-110.021898, 59.994249),
+    (-119.997483, 60.005236),
+]]
+
+CALIFORNIA_COORDS = [[
+    (-124.371877, 41.990849),  # long, lat
+    (-119.975840, 41.999506),
+    (-120.002350, 38.986355),
+    (-114.594288, 34.996728),
+    (-114.700328, 32.729648),
+    (-117.205534, 32.551061),
+    (-125.953869, 35.580972)
+]]
+
+REGIONS = {
+    "san_francisco": SAN_FRANCISCO_COORDS,
+    "calgary": CALGARY_COORDS,
+    "alberta": ALBERTA_COORDS,
+    "california": CALIFORNIA_COORDS,
+}
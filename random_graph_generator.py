@@ -1,10 +1,14 @@
-import random
+import json
+import math
+import os
 import statistics
+from multiprocessing import Pool
 from pathlib import Path
 
-import networkx as nx
+import numpy as np
 
 from graph import Graph
+from metrics_cache import MetricsCache
 
 
 class Generator:
@@ -14,72 +18,229 @@ class Generator:
     NUM_OF_VENUES = 8000
     NUM_OF_EDGES = 21000
     FRIENDSHIP_PROBABILITY = 0.0008
+    MAX_RATE = 5
+    SEED = 0
+    CONFIDENCE_LEVEL = 0.95
+    CONFIDENCE_Z = 1.96
+    METRIC_DESCRIPTIONS = {
+        "avg_degree": "Average degree",
+        "inf_top_10": "Average influence for top 10%",
+        "inf_top_10_20": "Average influence for top 10-20%",
+        "inf_top_20_30": "Average influence for top 20-30%",
+        "followings_inf": "Average followings influence on users rates",
+    }
 
     @staticmethod
-    def run():
-        for i in range(25, 101):
-            Generator.store_random_graph(Generator.DIRECTORY, i)
-            print(f"Generated {i}/{Generator.SAMPLES}")
+    def run(num_of_samples=SAMPLES, workers=1):
+        Generator.generate_samples(num_of_samples, workers)
 
     @staticmethod
-    def store_random_graph(base_dir, sample_number):
+    def generate_samples(num_of_samples, workers=1, base_dir=DIRECTORY, seed=SEED, first_sample=1):
+        sample_numbers = range(first_sample, first_sample + num_of_samples)
+        arguments = [(base_dir, sample_number, seed) for sample_number in sample_numbers]
+        if workers == 1:
+            for generated, argument in enumerate(arguments, start=1):
+                Generator.store_random_graph(*argument)
+                print(f"Generated {generated}/{num_of_samples}")
+            return
+        with Pool(workers) as pool:
+            for generated, _ in enumerate(pool.imap_unordered(_store_random_graph, arguments), start=1):
+                print(f"Generated {generated}/{num_of_samples}")
+
+    @staticmethod
+    def get_random_generator(sample_number, seed=SEED):
+        # every sample gets its own stream, so a sample is the same whichever worker or order produces it
+        return np.random.default_rng([seed, sample_number])
+
+    @staticmethod
+    def get_random_ratings(rng, num_of_users=NUM_OF_USERS, num_of_venues=NUM_OF_VENUES, num_of_ratings=NUM_OF_EDGES):
+        # users, venues and rates of uniformly drawn ratings (a user may rate a venue twice)
+        users = rng.integers(0, num_of_users, num_of_ratings)
+        venues = rng.integers(0, num_of_venues, num_of_ratings)
+        rates = rng.integers(1, Generator.MAX_RATE + 1, num_of_ratings)
+        return users, venues, rates
+
+    @staticmethod
+    def get_random_friendships(rng, num_of_users=NUM_OF_USERS, probability=FRIENDSHIP_PROBABILITY):
+        # Directed G(n, p) without self loops. The gaps between kept pairs, over the n(n - 1) ordered pairs,
+        # are geometric, so only the kept pairs are drawn instead of a coin for every pair.
+        num_of_pairs = num_of_users * (num_of_users - 1)
+        expected = num_of_pairs * probability
+        batch_size = int(expected + 6 * math.sqrt(expected)) + 1
+        positions = np.cumsum(rng.geometric(probability, batch_size)) - 1
+        while positions[-1] < num_of_pairs:
+            positions = np.concatenate([positions, positions[-1] + np.cumsum(rng.geometric(probability, batch_size))])
+        positions = positions[positions < num_of_pairs]
+
+        first = positions // (num_of_users - 1)
+        second = positions % (num_of_users - 1)
+        second += second >= first
+        return first, second
+
+    @staticmethod
+    def store_random_graph(base_dir, sample_number, seed=SEED):
         Path(f"{base_dir}/{sample_number}").mkdir(parents=True, exist_ok=True)
-        users = [i for i in range(Generator.NUM_OF_USERS)]
-        venues = [i for i in range(Generator.NUM_OF_VENUES)]
-        rates = [1, 2, 3, 4, 5]
+        rng = Generator.get_random_generator(sample_number, seed)
+        users = np.arange(Generator.NUM_OF_USERS)
 
         # Store users
-        with open(f"{base_dir}/{sample_number}/users.txt", 'w') as file:
-            for user in users:
-                file.write(f"{user} 0 0\n")
+        coordinates = np.zeros((len(users), 2), dtype=np.int64)
+        np.savetxt(f"{base_dir}/{sample_number}/users.txt", np.column_stack([users, coordinates]), fmt='%d')
 
         # Generate random ratings.txt file
-        with open(f"{base_dir}/{sample_number}/ratings.txt", 'w') as file:
-            for _ in range(Generator.NUM_OF_EDGES):
-                user = random.choice(users)
-                venue = random.choice(venues)
-                rate = random.choice(rates)
-                file.write(f"{user} {venue} {rate}\n")
+        np.savetxt(
+            f"{base_dir}/{sample_number}/ratings.txt", np.column_stack(Generator.get_random_ratings(rng)), fmt='%d'
+        )
 
         # Generate random friendships.txt file
-        with open(f"{base_dir}/{sample_number}/friendships.txt", 'w') as file:
-            friendship_graph = nx.generators.random_graphs.erdos_renyi_graph(
-                Generator.NUM_OF_USERS, Generator.FRIENDSHIP_PROBABILITY,
-                directed=True
-            )
-            for edge in friendship_graph.edges:
-                file.write(f"{edge[0]} {edge[1]}\n")
+        np.savetxt(
+            f"{base_dir}/{sample_number}/friendships.txt", np.column_stack(Generator.get_random_friendships(rng)),
+            fmt='%d'
+        )
+
+    @staticmethod
+    def get_random_graph(sample_number, seed=SEED):
+        # The same sample store_random_graph writes, built straight from the drawn arrays. Like a graph built
+        # from the files, the crowd statistics only count the ratings of users that ended up in the graph.
+        rng = Generator.get_random_generator(sample_number, seed)
+        users, venues, rates = Generator.get_random_ratings(rng)
+        first, second = Generator.get_random_friendships(rng)
+
+        user_venue_ratings = {}
+        for user, venue, rate in zip(users.tolist(), venues.tolist(), rates.tolist()):
+            user_venue_ratings.setdefault(user, {})[venue] = rate
+        followings = {}
+        for follower, following in zip(first.tolist(), second.tolist()):
+            followings.setdefault(follower, set()).add(following)
+        coordinates = {user: (0.0, 0.0) for user in range(Generator.NUM_OF_USERS)}
+
+        graph = Graph()
+        graph.build_graph(user_venue_ratings, coordinates, followings)
+        in_graph = np.isin(users, graph.compact_graph.node_ids)
+        graph.rating_statistics.set_ratings(venues[in_graph], rates[in_graph])
+        return graph
 
     @staticmethod
-    def calculate_metrics_on_random_graphs(limit=None):
+    def calculate_metrics_on_random_graphs(
+            limit=None, workers=1, results_file=None, in_memory=False, seed=SEED, cache_directory=DIRECTORY
+    ):
+        # Samples are independent, so they are evaluated by a pool of workers and each result is appended
+        # to results_file (one json line per sample) as soon as it arrives; samples already in it are skipped.
+        # in_memory draws each sample and builds its graph on the spot instead of reading random_graphs/<i>.
+        # Sample metrics are kept in a MetricsCache in cache_directory (None turns it off) shared by the workers.
         if limit is None:
             limit = Generator.SAMPLES
 
-        avg_degrees = []
-        inf_top_10 = []
-        inf_top_10_20 = []
-        inf_top_20_30 = []
-        followings_inf = []
-        for i in range(1, limit + 1):
-            graph = Graph(data_dir=f"random_graphs/{i}")
-            # graph.create_graph_from_inputs()
-            graph.read_graph()
-
-            # Question 1
-            avg_degrees.append(sum(d for n, d in graph.graph.degree()) / graph.graph.number_of_nodes())
-            inf_top_10.append(graph.get_average_influence_for_top_influential_users(0, 0.1))
-            inf_top_10_20.append(graph.get_average_influence_for_top_influential_users(0.1, 0.2))
-            inf_top_20_30.append(graph.get_average_influence_for_top_influential_users(0.2, 0.3))
-            # Question 2
-            followings_inf.append(graph.get_average_friends_influence_on_users_rate())
-            print(f"{i}/{limit} random graphs processed")
-
-        print(f"Average degree for random models: {statistics.mean(avg_degrees)}")
-        print(f"Average influence for top 10% for random models is {statistics.mean(inf_top_10)}")
-        print(f"Average influence for top 10-20% for random models is {statistics.mean(inf_top_10_20)}")
-        print(f"Average influence for top 20-30% for random models is {statistics.mean(inf_top_20_30)}")
-
-        print(f"Average followings influence on users rates for random models is {statistics.mean(followings_inf)}")
+        results = Generator.read_results(results_file)
+        pending = [i for i in range(1, limit + 1) if i not in results]
+        for sample_metrics in Generator.__iter_samples_metrics(pending, workers, in_memory, seed, cache_directory):
+            results[sample_metrics["sample"]] = sample_metrics
+            Generator.append_result(results_file, sample_metrics)
+            print(f"{len(results)}/{limit} random graphs processed")
+
+        summary = Generator.summarize_metrics([results[i] for i in range(1, limit + 1)])
+        for metric, description in Generator.METRIC_DESCRIPTIONS.items():
+            mean, confidence = summary[metric]
+            print(f"{description} for random models is {mean} (± {confidence} at {Generator.CONFIDENCE_LEVEL:.0%})")
+        return summary
+
+    @staticmethod
+    def get_sample_metrics(sample_number, in_memory=False, seed=SEED, cache_directory=None):
+        metrics_cache = MetricsCache(cache_directory) if cache_directory is not None else None
+        if in_memory:
+            if metrics_cache is None:
+                return Generator.__get_graph_metrics(Generator.get_random_graph(sample_number, seed), sample_number)
+            # a drawn sample only depends on the model, so a cached one is reused without drawing it again
+            return metrics_cache.get_or_compute(
+                Generator.get_model_fingerprint(seed), "sample_metrics", {"sample": sample_number},
+                lambda: Generator.__get_graph_metrics(Generator.get_random_graph(sample_number, seed), sample_number)
+            )
+        graph = Graph(data_dir=f"{Generator.DIRECTORY}/{sample_number}", cache_metrics=False)
+        graph.metrics_cache = metrics_cache
+        graph.read_graph()
+        return Generator.__get_graph_metrics(graph, sample_number)
+
+    @staticmethod
+    def get_model_fingerprint(seed=SEED):
+        return MetricsCache.get_fingerprint(
+            seed, Generator.NUM_OF_USERS, Generator.NUM_OF_VENUES, Generator.NUM_OF_EDGES,
+            Generator.FRIENDSHIP_PROBABILITY, Generator.MAX_RATE, Graph.JUDGEMENT_VALIDITY_LIMIT
+        )
+
+    @staticmethod
+    def __get_graph_metrics(graph, sample_number):
+        # Question 1
+        avg_degree = int(graph.compact_graph.get_degrees().sum()) / graph.compact_graph.number_of_nodes
+        top_10, top_10_20, top_20_30 = graph.get_average_influences_for_top_influential_users(
+            [(0, 0.1), (0.1, 0.2), (0.2, 0.3)]
+        )
+        # Question 2
+        followings_inf = graph.get_average_friends_influence_on_users_rate()
+        return {
+            "sample": sample_number,
+            "avg_degree": avg_degree,
+            "inf_top_10": top_10,
+            "inf_top_10_20": top_10_20,
+            "inf_top_20_30": top_20_30,
+            "followings_inf": followings_inf,
+        }
+
+    @staticmethod
+    def summarize_metrics(samples_metrics):
+        # mean and half width of its normal-approximation confidence interval, per metric
+        summary = {}
+        for metric in Generator.METRIC_DESCRIPTIONS:
+            values = [sample_metrics[metric] for sample_metrics in samples_metrics]
+            confidence = math.nan
+            if len(values) > 1:
+                confidence = Generator.CONFIDENCE_Z * statistics.stdev(values) / math.sqrt(len(values))
+            summary[metric] = (statistics.mean(values), confidence)
+        return summary
+
+    @staticmethod
+    def read_results(results_file):
+        results = {}
+        if results_file is None or not os.path.exists(results_file):
+            return results
+        with open(results_file, 'r') as file:
+            for line in file:
+                # a run killed mid-write can leave a truncated last line, that sample is simply redone
+                try:
+                    sample_metrics = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                results[sample_metrics["sample"]] = sample_metrics
+        return results
+
+    @staticmethod
+    def append_result(results_file, sample_metrics):
+        if results_file is None:
+            return
+        with open(results_file, 'a+b') as file:
+            # a truncated last line left by a killed run is ended first, so it doesn't swallow this result
+            if file.tell() > 0:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    file.write(b"\n")
+            file.write(f"{json.dumps(sample_metrics)}\n".encode())
+
+    @staticmethod
+    def __iter_samples_metrics(sample_numbers, workers, in_memory, seed, cache_directory):
+        arguments = [(sample_number, in_memory, seed, cache_directory) for sample_number in sample_numbers]
+        if workers == 1:
+            for argument in arguments:
+                yield Generator.get_sample_metrics(*argument)
+            return
+        with Pool(workers) as pool:
+            yield from pool.imap_unordered(_get_sample_metrics, arguments)
+
+
+def _store_random_graph(arguments):
+    Generator.store_random_graph(*arguments)
+
+
+def _get_sample_metrics(arguments):
+    return Generator.get_sample_metrics(*arguments)
 
 
 # Generator.run()
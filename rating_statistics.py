@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+
+from metrics_cache import MetricsCache
+from models import Rating, RecordBatch
+
+
+class RatingStatistics:
+    # Per-venue rate histograms of a ratings file, kept in memory and optionally next to the graph store.
+    # They are recomputed only when the file's modification time or size changes. Without a ratings file,
+    # the statistics are whatever set_ratings was last given. mask_file is an optional boolean .npy of the
+    # rows to count (rows past its end count too), for a ratings file that was left unpruned.
+    ARRAY_NAMES = ("signature", "venue_ids", "venue_rating_counts")
+
+    def __init__(self, ratings_file, max_rate, store_directory=None, mask_file=None):
+        self.ratings_file = ratings_file
+        self.mask_file = mask_file
+        self.max_rate = max_rate
+        self.store_directory = store_directory
+        self.signature = None
+        self.venue_ids = None
+        self.venue_rating_counts = None
+
+    def refresh(self):
+        # returns whether the statistics changed since the last call
+        if self.ratings_file is None:
+            return False
+        signature = self.__get_file_signature()
+        if self.signature is not None and np.array_equal(signature, self.signature):
+            return False
+        if not self.__load(signature):
+            self.__compute(signature)
+            self.__save()
+        return True
+
+    def set_ratings(self, venue_ids, rates):
+        self.__count(np.asarray(venue_ids, dtype=np.int64), np.asarray(rates, dtype=np.int64))
+
+    def get_fingerprint(self):
+        # changes whenever the statistics would, without reading the ratings file
+        if self.ratings_file is None:
+            return MetricsCache.get_fingerprint(self.venue_ids, self.venue_rating_counts)
+        return MetricsCache.get_fingerprint(self.__get_file_signature())
+
+    def get_venue_ratings_percentage(self, venue_ids):
+        # rows follow the given venue ids, venues missing from the ratings file get NaN rows
+        self.refresh()
+        if self.venue_ids is None:
+            raise ValueError("no rating statistics: there is no ratings file and set_ratings was never called")
+        positions = np.minimum(np.searchsorted(self.venue_ids, venue_ids), max(len(self.venue_ids) - 1, 0))
+        venue_rating_counts = np.full((len(venue_ids), self.max_rate), np.nan)
+        if len(self.venue_ids) > 0:
+            found = self.venue_ids[positions] == venue_ids
+            venue_rating_counts[found] = self.venue_rating_counts[positions[found]]
+        return venue_rating_counts / venue_rating_counts.sum(axis=1, keepdims=True)
+
+    def __get_file_signature(self):
+        stat = os.stat(self.ratings_file)
+        mask_stat = (0, 0)
+        if self.mask_file is not None and os.path.isfile(self.mask_file):
+            mask_stat = (os.stat(self.mask_file).st_mtime_ns, os.stat(self.mask_file).st_size)
+        return np.array([stat.st_mtime_ns, stat.st_size, *mask_stat], dtype=np.int64)
+
+    def __compute(self, signature):
+        ratings = RecordBatch.read(self.ratings_file, Rating)
+        counted = np.ones(len(ratings), dtype=np.bool_)
+        if self.mask_file is not None and os.path.isfile(self.mask_file):
+            mask = np.load(self.mask_file)[:len(ratings)]
+            counted[:len(mask)] = mask
+        self.__count(ratings["venue_id"][counted], ratings["rate"][counted].astype(np.int64))
+        self.signature = signature
+
+    def __count(self, venue_ids, rates):
+        self.venue_ids, venue_positions = np.unique(venue_ids, return_inverse=True)
+        self.venue_rating_counts = np.zeros((len(self.venue_ids), self.max_rate))
+        np.add.at(self.venue_rating_counts, (venue_positions, rates - 1), 1)
+
+    def __load(self, signature):
+        if self.store_directory is None:
+            return False
+        paths = {name: os.path.join(self.store_directory, f"{name}.npy") for name in self.ARRAY_NAMES}
+        if not all(os.path.isfile(path) for path in paths.values()):
+            return False
+        if not np.array_equal(np.load(paths["signature"]), signature):
+            return False
+        self.venue_ids = np.load(paths["venue_ids"])
+        self.venue_rating_counts = np.load(paths["venue_rating_counts"])
+        self.signature = signature
+        return True
+
+    def __save(self):
+        if self.store_directory is None:
+            return
+        os.makedirs(self.store_directory, exist_ok=True)
+        for name in self.ARRAY_NAMES:
+            np.save(os.path.join(self.store_directory, f"{name}.npy"), getattr(self, name))
@@ -0,0 +1,268 @@
+import bisect
+import collections
+import heapq
+import statistics
+from multiprocessing import Pool
+
+import numpy as np
+from scipy import sparse
+from tqdm import tqdm
+
+from instrumentation import span
+
+INDEX_ENGINE = "index"
+SPARSE_ENGINE = "sparse"
+MAX_RATE_DIFF = 5
+CHUNKS_PER_WORKER = 16
+
+_worker_edge_builder = None
+
+
+def get_judgement_validity(amount, judgement_validity_limit):
+    if amount >= judgement_validity_limit:
+        return 1
+    return amount / judgement_validity_limit
+
+
+def get_pair_weight(venue_ratings1, venue_ratings2, judgement_validity_limit):
+    # weight of the edge between two users, None if they have no venue in common
+    rating_similarities = []
+    for venue_id, rate in venue_ratings1.items():
+        if venue_ratings2.get(venue_id):
+            diff = int(venue_ratings2[venue_id]) - int(rate)
+            rating_similarities.append((5 - abs(diff)) / 5)
+    if len(rating_similarities) == 0:
+        return None
+    return statistics.mean(rating_similarities) * get_judgement_validity(
+        len(rating_similarities), judgement_validity_limit
+    )
+
+
+class IndexEdgeBuilder:
+    # Only pairs that co-rated at least one venue can get an edge, so walk a venue -> raters index
+    # instead of every user pair.
+
+    def __init__(self, user_venue_ratings, judgement_validity_limit):
+        self.user_ids = list(user_venue_ratings)
+        self.user_ratings = list(user_venue_ratings.values())
+        self.judgement_validity_limit = judgement_validity_limit
+        self.venue_raters = self.__get_venue_raters()
+
+    def get_rows_weighted_edges(self, start, end):
+        edges = []
+        for index1 in range(start, end):
+            pair_rating_similarities = collections.defaultdict(list)
+            for venue_id, rate1 in self.user_ratings[index1].items():
+                raters, rates = self.venue_raters[venue_id]
+                for position in range(bisect.bisect_right(raters, index1), len(raters)):
+                    diff = int(rates[position]) - int(rate1)
+                    pair_rating_similarities[raters[position]].append((5 - abs(diff)) / 5)
+
+            for index2 in sorted(pair_rating_similarities):
+                rating_similarities = pair_rating_similarities[index2]
+                judgement_validity = get_judgement_validity(len(rating_similarities), self.judgement_validity_limit)
+                edges.append((
+                    self.user_ids[index1],
+                    self.user_ids[index2],
+                    statistics.mean(rating_similarities) * judgement_validity
+                ))
+        return edges
+
+    def __get_venue_raters(self):
+        venue_raters = {}
+        for index, venue_ratings in enumerate(self.user_ratings):
+            for venue_id, rate in venue_ratings.items():
+                if venue_raters.get(venue_id):
+                    venue_raters[venue_id][0].append(index)
+                    venue_raters[venue_id][1].append(rate)
+                else:
+                    venue_raters[venue_id] = ([index], [rate])
+        return venue_raters
+
+
+class SparseEdgeBuilder:
+    # Encodes the ratings as a CSR user x venue matrix and gets co-rating counts and summed
+    # |rate difference| for a block of users against everyone else from sparse products.
+
+    def __init__(self, user_venue_ratings, judgement_validity_limit):
+        self.user_ids = np.array(list(user_venue_ratings), dtype=object)
+        self.judgement_validity_limit = judgement_validity_limit
+        self.ratings = get_rating_matrix(user_venue_ratings)
+        self.rated = self.ratings.copy()
+        self.rated.data = np.ones_like(self.rated.data)
+        self.rated_above_thresholds = []
+        if self.ratings.nnz > 0:
+            for threshold in range(int(self.ratings.data.min()), int(self.ratings.data.max())):
+                above = self.ratings.copy()
+                above.data = (above.data > threshold).astype(np.int32)
+                above.eliminate_zeros()
+                self.rated_above_thresholds.append(above)
+
+    def get_rows_weighted_edges(self, start, end):
+        block_rated = self.rated[start:end]
+        common_venues = sparse.triu(block_rated @ self.rated.T, k=start + 1).tocsr()
+        common_venues.sort_indices()
+        rate_diffs = self.__get_abs_rate_diffs(start, end)
+
+        rows = np.repeat(np.arange(end - start), np.diff(common_venues.indptr))
+        targets = common_venues.indices
+        amounts = common_venues.data.astype(np.float64)
+        diffs = np.asarray(rate_diffs[rows, targets]).ravel().astype(np.float64)
+
+        # mean of (5 - |diff|) / 5 over the common venues, times the judgement validity
+        weights = (MAX_RATE_DIFF * amounts - diffs) / (MAX_RATE_DIFF * amounts)
+        weights *= np.minimum(amounts, self.judgement_validity_limit) / self.judgement_validity_limit
+
+        return list(zip(
+            self.user_ids[rows + start].tolist(),
+            self.user_ids[targets].tolist(),
+            weights.tolist()
+        ))
+
+    def __get_abs_rate_diffs(self, start, end):
+        # |a - b| is the number of thresholds t with exactly one of a, b above t,
+        # so summing it over common venues only needs products of indicator matrices.
+        block_rated = self.rated[start:end]
+        rate_diffs = sparse.csr_matrix((end - start, self.rated.shape[0]), dtype=np.int64)
+        for above in self.rated_above_thresholds:
+            block_above = above[start:end]
+            rate_diffs = (
+                    rate_diffs
+                    + block_above @ self.rated.T
+                    + block_rated @ above.T
+                    - 2 * (block_above @ above.T)
+            )
+        return rate_diffs.tocsr()
+
+
+def get_rating_matrix(user_venue_ratings):
+    venue_indices = {}
+    indptr = [0]
+    indices = []
+    data = []
+    for venue_ratings in user_venue_ratings.values():
+        for venue_id, rate in venue_ratings.items():
+            indices.append(venue_indices.setdefault(venue_id, len(venue_indices)))
+            data.append(int(rate))
+        indptr.append(len(indices))
+    return sparse.csr_matrix(
+        (np.array(data, dtype=np.int32), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+        shape=(len(user_venue_ratings), len(venue_indices))
+    )
+
+
+def get_edge_builder(user_venue_ratings, judgement_validity_limit, engine=INDEX_ENGINE):
+    if engine == SPARSE_ENGINE:
+        return SparseEdgeBuilder(user_venue_ratings, judgement_validity_limit)
+    if engine == INDEX_ENGINE:
+        return IndexEdgeBuilder(user_venue_ratings, judgement_validity_limit)
+    raise ValueError(f"unknown edge engine: {engine}")
+
+
+def get_weighted_edges(
+        user_venue_ratings, judgement_validity_limit, engine=INDEX_ENGINE, workers=1, min_weight=None, top_k=None
+):
+    # Users are split into contiguous row ranges and each range yields its edges in pair order,
+    # so concatenating the ranges in order gives the same edge list whatever the number of workers.
+    # min_weight drops lighter edges as soon as a range is computed, top_k keeps only the edges among the
+    # top_k heaviest of one of their users; either way only the kept edges are ever held for the whole graph.
+    if workers < 1:
+        raise ValueError(f"workers must be at least 1, got {workers}")
+    if top_k is not None and top_k < 1:
+        raise ValueError(f"top_k must be at least 1, got {top_k}")
+    with span("get_weighted_edges", engine=engine, workers=workers) as current:
+        edge_builder = get_edge_builder(user_venue_ratings, judgement_validity_limit, engine)
+        num_of_users = len(edge_builder.user_ids)
+        chunk_size = max(1, -(-num_of_users // (workers * CHUNKS_PER_WORKER)))
+        chunks = [
+            (start, min(start + chunk_size, num_of_users), min_weight)
+            for start in range(0, num_of_users, chunk_size)
+        ]
+
+        edges = []
+        top_neighbors = TopNeighbors(list(edge_builder.user_ids), top_k) if top_k is not None else None
+
+        def add_edges(chunk_edges):
+            if top_neighbors is None:
+                edges.extend(chunk_edges)
+            else:
+                top_neighbors.add_edges(chunk_edges)
+
+        with tqdm(total=num_of_users) as progress:
+            if workers == 1:
+                chunks_edges = (get_chunk_weighted_edges(edge_builder, *chunk) for chunk in chunks)
+                for (start, end, _), chunk_edges in zip(chunks, chunks_edges):
+                    add_edges(chunk_edges)
+                    progress.update(end - start)
+            else:
+                with Pool(workers, initializer=_init_worker, initargs=(edge_builder,)) as pool:
+                    for (start, end, _), chunk_edges in zip(chunks, pool.imap(_get_chunk_weighted_edges, chunks)):
+                        add_edges(chunk_edges)
+                        progress.update(end - start)
+        if top_neighbors is not None:
+            edges = top_neighbors.get_edges()
+
+        if current.enabled:
+            current.add_count("users", num_of_users)
+            current.add_count("pairs_visited", get_co_rating_pairs(user_venue_ratings))
+            current.add_count("edges", len(edges))
+    return edges
+
+
+def get_chunk_weighted_edges(edge_builder, start, end, min_weight=None):
+    edges = edge_builder.get_rows_weighted_edges(start, end)
+    if min_weight is None:
+        return edges
+    return [edge for edge in edges if edge[2] >= min_weight]
+
+
+class TopNeighbors:
+    # A bounded min-heap of (weight, neighbor position) per user holding its top_k heaviest edges seen so far.
+    # An edge is kept if it ends up in the heap of either of its users, ties go to the later neighbor.
+
+    def __init__(self, user_ids, top_k):
+        self.user_ids = user_ids
+        self.top_k = top_k
+        self.user_positions = {user_id: position for position, user_id in enumerate(user_ids)}
+        self.heaps = [[] for _ in user_ids]
+
+    def add_edges(self, edges):
+        for user1, user2, weight in edges:
+            position1, position2 = self.user_positions[user1], self.user_positions[user2]
+            self.__push(position1, (weight, position2))
+            self.__push(position2, (weight, position1))
+
+    def get_edges(self):
+        # the kept edges in the order the full build emits them
+        edge_weights = {}
+        for position, heap in enumerate(self.heaps):
+            for weight, neighbor in heap:
+                edge_weights[(min(position, neighbor), max(position, neighbor))] = weight
+        return [
+            (self.user_ids[position1], self.user_ids[position2], edge_weights[(position1, position2)])
+            for position1, position2 in sorted(edge_weights)
+        ]
+
+    def __push(self, position, entry):
+        heap = self.heaps[position]
+        if len(heap) < self.top_k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+
+def get_co_rating_pairs(user_venue_ratings):
+    # the (user, user, venue) triples both engines go through, one per pair of raters of a venue
+    raters = np.array(list(collections.Counter(
+        venue_id for venue_ratings in user_venue_ratings.values() for venue_id in venue_ratings
+    ).values()), dtype=np.int64)
+    return int((raters * (raters - 1) // 2).sum())
+
+
+def _init_worker(edge_builder):
+    global _worker_edge_builder
+    _worker_edge_builder = edge_builder
+
+
+def _get_chunk_weighted_edges(chunk):
+    return get_chunk_weighted_edges(_worker_edge_builder, *chunk)